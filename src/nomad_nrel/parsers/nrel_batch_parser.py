@@ -23,9 +23,12 @@ Created on Fri Sep 27 09:08:03 2024
 # limitations under the License.
 #
 
+import os
+from functools import lru_cache
+
+import numpy as np
 import pandas as pd
 from baseclasses import LayerProperties, PubChemPureSubstanceSectionCustom
-from baseclasses.helper.utilities import create_archive
 from baseclasses.material_processes_misc import (
     AirKnifeGasQuenching,
     Annealing,
@@ -52,14 +55,25 @@ from nomad.datamodel.data import (
     EntryData,
 )
 from nomad.datamodel.metainfo.basesections import (
-    CompositeSystemReference,
     Entity,
 )
 from nomad.metainfo import (
     Quantity,
 )
 from nomad.parsing import MatchingParser
-
+from pandas.api.types import is_datetime64_any_dtype, is_timedelta64_dtype
+
+from nomad_nrel.parsers.utils import (
+    compare_fingerprints,
+    get_fingerprints_file_name,
+    get_reference,
+    get_sample_references,
+    read_fingerprints,
+    read_workbook,
+    sniff_workbook_header,
+    write_archives,
+    write_fingerprints,
+)
 from nomad_nrel.schema_packages.nrel_package import (
     NREL_AtomicLayerDeposition,
     NREL_Batch,
@@ -78,16 +92,12 @@ from nomad_nrel.schema_packages.nrel_package import (
 This is a hello world style example for an example parser/converter.
 """
 
-
-def get_entry_id_from_file_name(file_name, upload_id):
-    from nomad.utils import hash
-
-    return hash(upload_id, file_name)
-
-
-def get_reference(upload_id, file_name):
-    entry_id = get_entry_id_from_file_name(file_name, upload_id)
-    return f'../uploads/{upload_id}/archive/{entry_id}#data'
+# Increase when the mapping changes, so that all generated entries are
+# rewritten on the next parse.
+MAPPER_VERSION = 1
+# Number of distinct solutions, and of solution column layouts, kept for reuse
+# between processes.
+SOLUTION_CACHE_SIZE = 512
 
 
 def convert_quantity(value, factor):
@@ -97,7 +107,75 @@ def convert_quantity(value, factor):
         return None
 
 
+class RowRecord:
+    """
+    Lightweight view of one spreadsheet row created by `compile_rows`.
+    Missing cells are stored as None and numbers are converted up front, so
+    looking up a cell is a plain dict access.
+    """
+
+    __slots__ = ('index', '_numbers', '_values')
+
+    def __init__(self, index, values, numbers):
+        self.index = index
+        self._values = values
+        self._numbers = numbers
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def get(self, key, default=None):
+        value = self._values.get(key)
+        return default if value is None else value
+
+    def get_value(self, key, default=None, number=True):
+        value = self._values.get(key)
+        if value is None:
+            return default
+        if number:
+            number_value = self._numbers[key]
+            # not numeric, float raises the same error as for a pandas row
+            return float(value) if number_value is None else number_value
+        return str(value).strip()
+
+
+def compile_rows(df, positions=None):
+    """
+    Converts the rows of a column group at `positions` (all rows by default)
+    to `RowRecord`s. Missing values and numbers are computed column-wise for
+    the whole group at once.
+    """
+    if positions is None:
+        positions = range(len(df))
+    positions = list(positions)
+    columns = tuple(df.columns)
+    values = df.to_numpy(dtype=object)[positions]
+    missing = df.isna().to_numpy()[positions]
+    numbers = np.full(values.shape, np.nan)
+    for k in range(len(columns)):
+        column = df.iloc[:, k]
+        if is_datetime64_any_dtype(column) or is_timedelta64_dtype(column):
+            continue
+        numbers[:, k] = pd.to_numeric(column.iloc[positions], errors='coerce').to_numpy(
+            dtype=float, na_value=np.nan
+        )
+    values[missing] = None
+    not_numeric = np.isnan(numbers)
+    numbers = numbers.astype(object)
+    numbers[not_numeric] = None
+
+    return [
+        RowRecord(columns, dict(zip(columns, v)), dict(zip(columns, n)))
+        for v, n in zip(values.tolist(), numbers.tolist())
+    ]
+
+
 def get_value(data, key, default=None, number=True):
+    if isinstance(data, RowRecord):
+        return data.get_value(key, default, number)
     try:
         if key not in data:
             return default
@@ -110,6 +188,10 @@ def get_value(data, key, default=None, number=True):
         raise e
 
 
+def get_substrate_key(data, columns):
+    return tuple(data.get(col) for col in columns)
+
+
 def map_basic_sample(data, substrate_name, upload_id):
     archive = NREL_Sample(
         name=data['Nomad ID'],
@@ -124,63 +206,73 @@ def map_batch(batch_ids, batch_id, upload_id):
     archive = NREL_Batch(
         name=batch_id,
         lab_id=batch_id,
-        entities=[
-            CompositeSystemReference(
-                reference=get_reference(upload_id, f'{lab_id}.archive.json'),
-                lab_id=lab_id,
-            )
-            for lab_id in batch_ids
-        ],
+        entities=get_sample_references(upload_id, batch_ids),
     )
     return (batch_id, archive)
 
 
-def map_solutions(data):
-    solvents = []
-    solutes = []
-    for col in data.index:
+@lru_cache(maxsize=SOLUTION_CACHE_SIZE)
+def get_solution_layout(columns):
+    """
+    Returns the sorted solvent and solute prefixes, e.g. `Solvent 1`, of the
+    columns of a process group. Computed once per column layout.
+    """
+    solvents = set()
+    solutes = set()
+    for col in columns:
         if 'solvent' in col.lower():
-            solvents.append(' '.join(col.split(' ')[:2]))
+            solvents.add(' '.join(col.split(' ')[:2]))
         if 'solute' in col.lower():
-            solutes.append(' '.join(col.split(' ')[:2]))
-
-    final_solvents = []
-    final_solutes = []
-    for solvent in sorted(set(solvents)):
-        if not get_value(data, f'{solvent} name', None, False) and not get_value(
-            data, f'{solvent} volume [uL]', None
-        ):
-            continue
-        final_solvents.append(
+            solutes.add(' '.join(col.split(' ')[:2]))
+    return sorted(solvents), sorted(solutes)
+
+
+@lru_cache(maxsize=SOLUTION_CACHE_SIZE)
+def build_solution(solvents, solutes):
+    return Solution(
+        solvent=[
             SolutionChemical(
                 chemical_2=PubChemPureSubstanceSectionCustom(
-                    name=get_value(data, f'{solvent} name', None, False),
+                    name=name,
                     load_data=False,
                 ),
-                chemical_volume=convert_quantity(
-                    get_value(data, f'{solvent} volume [uL]', None), 1 / 1000
-                ),
+                chemical_volume=convert_quantity(volume, 1 / 1000),
             )
-        )
-    for solute in sorted(set(solutes)):
-        if not get_value(data, f'{solute} type', None, False) and not get_value(
-            data, f'{solute} Concentration [mM]', None
-        ):
-            continue
-        final_solutes.append(
+            for name, volume in solvents
+        ],
+        solute=[
             SolutionChemical(
                 chemical_2=PubChemPureSubstanceSectionCustom(
-                    name=get_value(data, f'{solute} type', None, False), load_data=False
-                ),
-                concentration_mol=convert_quantity(
-                    get_value(data, f'{solute} Concentration [mM]', None), 1 / 1000
+                    name=name, load_data=False
                 ),
+                concentration_mol=convert_quantity(concentration, 1 / 1000),
             )
-        )
+            for name, concentration in solutes
+        ],
+    )
 
-    archive = Solution(solvent=final_solvents, solute=final_solutes)
 
-    return archive
+def map_solutions(data):
+    solvent_prefixes, solute_prefixes = get_solution_layout(tuple(data.index))
+
+    solvents = []
+    solutes = []
+    for solvent in solvent_prefixes:
+        name = get_value(data, f'{solvent} name', None, False)
+        volume = get_value(data, f'{solvent} volume [uL]', None)
+        if not name and not volume:
+            continue
+        solvents.append((name, volume))
+    for solute in solute_prefixes:
+        name = get_value(data, f'{solute} type', None, False)
+        concentration = get_value(data, f'{solute} Concentration [mM]', None)
+        if not name and not concentration:
+            continue
+        solutes.append((name, concentration))
+
+    # identical solutions are built once, every process gets its own copy;
+    # a deep copy takes about half the time of building the sections again
+    return build_solution(tuple(solvents), tuple(solutes)).m_copy(deep=True)
 
 
 def map_spin_coating(i, j, lab_ids, data, upload_id):
@@ -188,13 +280,7 @@ def map_spin_coating(i, j, lab_ids, data, upload_id):
         name='spin coating ' + get_value(data, 'Material name', '', False),
         positon_in_experimental_plan=i,
         description=get_value(data, 'Notes', '', False),
-        samples=[
-            CompositeSystemReference(
-                reference=get_reference(upload_id, f'{lab_id}.archive.json'),
-                lab_id=lab_id,
-            )
-            for lab_id in lab_ids
-        ],
+        samples=get_sample_references(upload_id, lab_ids),
         layer=[
             LayerProperties(
                 layer_type=get_value(data, 'Layer type', None, False),
@@ -239,13 +325,7 @@ def map_sdc(i, j, lab_ids, data, upload_id):
         name='slot die coating ' + get_value(data, 'Material name', '', False),
         positon_in_experimental_plan=i,
         description=get_value(data, 'Notes', None, False),
-        samples=[
-            CompositeSystemReference(
-                reference=get_reference(upload_id, f'{lab_id}.archive.json'),
-                lab_id=lab_id,
-            )
-            for lab_id in lab_ids
-        ],
+        samples=get_sample_references(upload_id, lab_ids),
         solution=[
             PrecursorSolution(
                 solution_details=map_solutions(data),  # check unit
@@ -288,13 +368,7 @@ def map_cleaning(i, j, lab_ids, data, upload_id):
         name='Cleaning',
         positon_in_experimental_plan=i,
         description=get_value(data, 'Notes', '', False),
-        samples=[
-            CompositeSystemReference(
-                reference=get_reference(upload_id, f'{lab_id}.archive.json'),
-                lab_id=lab_id,
-            )
-            for lab_id in lab_ids
-        ],
+        samples=get_sample_references(upload_id, lab_ids),
     )
     return (f'{i}_{j}_cleaning', archive)
 
@@ -319,13 +393,7 @@ def map_evaporation(i, j, lab_ids, data, upload_id):
         name='evaporation ' + get_value(data, 'Material name', '', False),
         positon_in_experimental_plan=i,
         description=get_value(data, 'Notes', '', False),
-        samples=[
-            CompositeSystemReference(
-                reference=get_reference(upload_id, f'{lab_id}.archive.json'),
-                lab_id=lab_id,
-            )
-            for lab_id in lab_ids
-        ],
+        samples=get_sample_references(upload_id, lab_ids),
         layer=[
             LayerProperties(
                 layer_type=get_value(data, 'Layer type', None, False),
@@ -365,13 +433,7 @@ def map_sputtering(i, j, lab_ids, data, upload_id):
         name='sputtering ' + get_value(data, 'Material name', '', False),
         positon_in_experimental_plan=i,
         description=get_value(data, 'Notes', '', False),
-        samples=[
-            CompositeSystemReference(
-                reference=get_reference(upload_id, f'{lab_id}.archive.json'),
-                lab_id=lab_id,
-            )
-            for lab_id in lab_ids
-        ],
+        samples=get_sample_references(upload_id, lab_ids),
         layer=[
             LayerProperties(
                 layer_type=get_value(data, 'Layer type', None, False),
@@ -404,13 +466,7 @@ def map_laser_scribing(i, j, lab_ids, data, upload_id):
     archive = NREL_LaserScribing(
         name='laser scribing',
         positon_in_experimental_plan=i,
-        samples=[
-            CompositeSystemReference(
-                reference=get_reference(upload_id, f'{lab_id}.archive.json'),
-                lab_id=lab_id,
-            )
-            for lab_id in lab_ids
-        ],
+        samples=get_sample_references(upload_id, lab_ids),
         properties=LaserScribingProperties(
             laser_wavelength=get_value(data, 'Laser wavelength [nm]', None),
             laser_pulse_time=get_value(data, 'Laser pulse time [ps]', None),
@@ -430,13 +486,7 @@ def map_atomic_layer_deposition(i, j, lab_ids, data, upload_id):
         + get_value(data, 'Material name', '', number=False),
         positon_in_experimental_plan=i,
         description=get_value(data, 'Notes', '', number=False),
-        samples=[
-            CompositeSystemReference(
-                reference=get_reference(upload_id, f'{lab_id}.archive.json'),
-                lab_id=lab_id,
-            )
-            for lab_id in lab_ids
-        ],
+        samples=get_sample_references(upload_id, lab_ids),
         layer=[
             LayerProperties(
                 layer_type=get_value(data, 'Layer type', None, number=False),
@@ -486,19 +536,81 @@ def map_generic(i, j, lab_ids, data, upload_id):
         name=get_value(data, 'Name', '', False),
         positon_in_experimental_plan=i,
         description=get_value(data, 'Notes', '', False),
-        samples=[
-            CompositeSystemReference(
-                reference=get_reference(upload_id, f'{lab_id}.archive.json'),
-                lab_id=lab_id,
-            )
-            for lab_id in lab_ids
-        ],
+        samples=get_sample_references(upload_id, lab_ids),
     )
     return (f'{i}_{j}_generic_process', archive)
 
 
+# Maps a part of the top level column header to the mapper of the process and
+# whether rows without a material name are skipped. Checked in order.
+PROCESS_MAPPERS = {
+    'Cleaning': (map_cleaning, False),
+    'Laser Scribing': (map_laser_scribing, False),
+    'Generic Process': (map_generic, False),
+    'Evaporation': (map_evaporation, True),
+    'Spin Coating': (map_spin_coating, True),
+    'Slot Die Coating': (map_sdc, True),
+    'Sputtering': (map_sputtering, True),
+    'ALD': (map_atomic_layer_deposition, True),
+}
+
+
+def register_process_mapper(key, mapper, requires_material=True):
+    """
+    Registers a mapper `mapper(i, j, lab_ids, data, upload_id)` for all
+    process columns whose header contains `key`.
+    """
+    PROCESS_MAPPERS[key] = (mapper, requires_material)
+
+
+def get_process_mapper(col):
+    for key, process_mapper in PROCESS_MAPPERS.items():
+        if key in col:
+            return process_mapper
+    return None
+
+
+def group_identical_rows(df, lab_ids):
+    """
+    Groups identical rows of one process column group in a single pass.
+    Every row is hashed once, rows with equal hashes share a process.
+    Returns tuples of the index of the first row of a group, the row as a
+    `RowRecord` and the `lab_ids` of all rows in the group, in order of first appearance
+    like `drop_duplicates`.
+    """
+    row_hashes = pd.util.hash_pandas_object(df, index=False)
+    codes, uniques = pd.factorize(row_hashes)
+    first_rows = [None] * len(uniques)
+    grouped_ids = [[] for _ in range(len(uniques))]
+    for position, (code, lab_id) in enumerate(zip(codes, lab_ids)):
+        if first_rows[code] is None:
+            first_rows[code] = position
+        grouped_ids[code].append(lab_id)
+
+    records = compile_rows(df, first_rows)
+    return [
+        (df.index[position], record, ids)
+        for position, record, ids in zip(first_rows, records, grouped_ids)
+    ]
+
+
 class RawNRELExperiment(EntryData):
     processed_archive = Quantity(type=Entity, shape=['*'])
+    added_entries = Quantity(
+        type=str,
+        shape=['*'],
+        description='Generated entries that did not exist in the previous parse.',
+    )
+    changed_entries = Quantity(
+        type=str,
+        shape=['*'],
+        description='Generated entries that were rewritten because they changed.',
+    )
+    removed_entries = Quantity(
+        type=str,
+        shape=['*'],
+        description='Entries of the previous parse that are no longer generated.',
+    )
 
 
 class NRELExperimentParser(MatchingParser):
@@ -516,106 +628,90 @@ class NRELExperimentParser(MatchingParser):
         if not is_mainfile_super:
             return False
         try:
-            df = pd.read_excel(filename, header=[0, 1])
-            df['Experiment Info']['Nomad ID'].dropna().to_list()
+            return sniff_workbook_header(filename, 'Experiment Info', 'Nomad ID')
         except Exception:
             return False
-        return True
 
     def parse(self, mainfile: str, archive: EntryArchive, logger):
         upload_id = archive.metadata.upload_id
-        # xls = pd.ExcelFile(mainfile)
-        df = pd.read_excel(mainfile, header=[0, 1])
+        df = read_workbook(mainfile)
 
         sample_ids = df['Experiment Info']['Nomad ID'].dropna().to_list()
         batch_id = '_'.join([sample_ids[0].split('_')[0], sample_ids[0].split('_')[2]])
         archives = [map_batch(sample_ids, batch_id, upload_id)]
         substrates = []
+        substrate_index = {}
         substrates_col = [
             'Sample dimension',
             'Sample area [cm^2]',
             'Substrate material',
             'Substrate conductive layer',
         ]
-        for i, sub in (
-            df['Experiment Info'][substrates_col].drop_duplicates().iterrows()
-        ):
-            if pd.isna(sub).all():
-                continue
-            substrates.append((f'{i}_substrate', sub, map_substrate(sub)))
-
-        def find_substrate(d):
-            for s in substrates:
-                if d.equals(s[1]):
-                    return s[0]
-
-        for i, row in df['Experiment Info'].iterrows():
-            if pd.isna(row).all():
+        info = df['Experiment Info']
+        empty_rows = info.isna().all(axis=1).to_numpy()
+        for i, row, empty in zip(info.index, compile_rows(info), empty_rows):
+            if empty:
                 continue
-            substrate_name = (
-                find_substrate(
-                    row[
-                        [
-                            'Sample dimension',
-                            'Sample area [cm^2]',
-                            'Substrate material',
-                            'Substrate conductive layer',
-                        ]
-                    ]
+            substrate_key = get_substrate_key(row, substrates_col)
+            if substrate_key not in substrate_index and any(
+                value is not None for value in substrate_key
+            ):
+                substrates.append((f'{i}_substrate', row, map_substrate(row)))
+                substrate_index[substrate_key] = f'{i}_substrate'
+            if substrate_key not in substrate_index:
+                raise ValueError(
+                    f'No substrate found for sample {row.get("Nomad ID")} '
+                    f'in row {i}, substrate columns {substrate_key}'
                 )
-                + '.archive.json'
-            )
+            substrate_name = f'{substrate_index[substrate_key]}.archive.json'
             archives.append(map_basic_sample(row, substrate_name, upload_id))
 
+        nomad_ids = df['Experiment Info']['Nomad ID'].to_list()
         for i, col in enumerate(df.columns.get_level_values(0).unique()):
             if col == 'Experiment Info':
                 continue
 
-            df_dropped = df[col].drop_duplicates()
-            for j, row in df_dropped.iterrows():
-                lab_ids = [
-                    x['Experiment Info']['Nomad ID']
-                    for _, x in df[['Experiment Info', col]].iterrows()
-                    if x[col].astype('object').equals(row.astype('object'))
-                ]
-                if 'Cleaning' in col:
-                    archives.append(map_cleaning(i, j, lab_ids, row, upload_id))
-
-                if 'Laser Scribing' in col:
-                    archives.append(map_laser_scribing(i, j, lab_ids, row, upload_id))
-
-                if 'Generic Process' in col:  # move up
-                    archives.append(map_generic(i, j, lab_ids, row, upload_id))
+            process_mapper = get_process_mapper(col)
+            if process_mapper is None:
+                logger.warning('unknown process column', column=col)
+                continue
+            mapper, requires_material = process_mapper
 
-                if pd.isna(row.get('Material name')):
+            for j, row, lab_ids in group_identical_rows(df[col], nomad_ids):
+                if requires_material and pd.isna(row.get('Material name')):
                     continue
+                archives.append(mapper(i, j, lab_ids, row, upload_id))
+
+        entries = [(f'{subs[0]}.archive.json', subs[2]) for subs in substrates]
+        entries.extend((f'{a[0]}.archive.json', a[1]) for a in archives)
+        # kept per workbook path, workbooks of the same name may be in
+        # different folders of the upload
+        fingerprints_file = get_fingerprints_file_name(
+            archive.metadata.mainfile or os.path.basename(mainfile)
+        )
+        previous_fingerprints = read_fingerprints(archive, fingerprints_file)
+        fingerprints = write_archives(
+            archive,
+            entries,
+            version=MAPPER_VERSION,
+            previous_fingerprints=previous_fingerprints,
+        )
+        write_fingerprints(archive, fingerprints_file, fingerprints)
+        added, changed, removed = compare_fingerprints(
+            previous_fingerprints, fingerprints
+        )
+        if previous_fingerprints:
+            logger.info(
+                'updated experiment entries',
+                added=len(added),
+                changed=len(changed),
+                removed=len(removed),
+            )
+        refs = [get_reference(upload_id, file_name) for file_name, _ in entries]
 
-                if 'Evaporation' in col:
-                    archives.append(map_evaporation(i, j, lab_ids, row, upload_id))
-
-                if 'Spin Coating' in col:
-                    archives.append(map_spin_coating(i, j, lab_ids, row, upload_id))
-
-                if 'Slot Die Coating' in col:
-                    archives.append(map_sdc(i, j, lab_ids, row, upload_id))
-
-                if 'Sputtering' in col:
-                    archives.append(map_sputtering(i, j, lab_ids, row, upload_id))
-
-                if 'ALD' in col:
-                    archives.append(
-                        map_atomic_layer_deposition(i, j, lab_ids, row, upload_id)
-                    )
-
-        refs = []
-        for subs in substrates:
-            file_name = f'{subs[0]}.archive.json'
-            create_archive(subs[2], archive, file_name)
-            refs.append(get_reference(upload_id, file_name))
-
-        for a in archives:
-            file_name = f'{a[0]}.archive.json'
-            create_archive(a[1], archive, file_name)
-            refs.append(get_reference(upload_id, file_name))
-
-        archive.data = RawNRELExperiment(processed_archive=refs)
+        archive.data = RawNRELExperiment(
+            processed_archive=refs,
+            added_entries=added,
+            changed_entries=changed,
+            removed_entries=removed,
+        )
@@ -21,8 +21,6 @@ import os
 
 from baseclasses.helper.utilities import (
     create_archive,
-    get_entry_id_from_file_name,
-    get_reference,
     set_sample_reference,
 )
 from nomad.datamodel import EntryArchive
@@ -40,6 +38,7 @@ from nomad.metainfo import (
 )
 from nomad.parsing import MatchingParser
 
+from nomad_nrel.parsers.utils import get_reference, get_sibling_files
 from nomad_nrel.schema_packages.nrel_package import (
     NREL_JVmeasurement,
 )
@@ -72,22 +71,14 @@ class NRELJVParser(MatchingParser):
         set_sample_reference(archive, entry, search_id)
 
         entry.name = f'{search_id} {mainfile_split[-2]} JV'
-        data_files = []
-        for item in archive.m_context.upload_files.raw_directory_list():
-            if (
-                item.path.startswith('_'.join(mainfile_split[0:2]))
-                and item.path.endswith('.txt')
-                and mainfile_split[-2] in item.path
-            ):
-                data_files.append(item.path)
-
-        entry.data_files = data_files
+        entry.data_files = get_sibling_files(
+            archive, mainfile, '_'.join(mainfile_split[0:2]), mainfile_split[-2]
+        )
 
         entry.datetime = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
 
         file_name = f'{os.path.basename(mainfile)}.archive.json'
-        eid = get_entry_id_from_file_name(file_name, archive)
         archive.data = RawFileNREL(
-            processed_archive=get_reference(archive.metadata.upload_id, eid)
+            processed_archive=get_reference(archive.metadata.upload_id, file_name)
         )
         create_archive(entry, archive, file_name)
@@ -0,0 +1,385 @@
+#
+# Copyright The NOMAD Authors.
+#
+# This file is part of NOMAD. See https://nomad-lab.eu for further info.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import hashlib
+import json
+import os
+import posixpath
+import zipfile
+from collections import OrderedDict
+from functools import lru_cache
+from xml.etree import ElementTree
+
+import pandas as pd
+from nomad.datamodel.context import ClientContext
+from nomad.datamodel.metainfo.basesections import CompositeSystemReference
+from nomad.utils import hash
+
+# Number of entry references kept in memory. Keys contain the upload id, so
+# entries of different uploads never share a reference.
+REFERENCE_CACHE_SIZE = 8192
+# Number of uploads whose raw directory index is kept in memory.
+DIRECTORY_INDEX_CACHE_SIZE = 8
+
+_directory_indices = OrderedDict()
+
+
+@lru_cache(maxsize=REFERENCE_CACHE_SIZE)
+def get_entry_id_from_file_name(file_name, upload_id):
+    return hash(upload_id, file_name)
+
+
+@lru_cache(maxsize=REFERENCE_CACHE_SIZE)
+def get_reference(upload_id, file_name):
+    entry_id = get_entry_id_from_file_name(file_name, upload_id)
+    return f'../uploads/{upload_id}/archive/{entry_id}#data'
+
+
+def get_sample_references(upload_id, lab_ids):
+    return [
+        CompositeSystemReference(
+            reference=get_reference(upload_id, f'{lab_id}.archive.json'),
+            lab_id=lab_id,
+        )
+        for lab_id in lab_ids
+    ]
+
+
+def read_workbook(path):
+    """
+    Reads the first sheet of an experiment workbook with its two header rows.
+    """
+    return pd.read_excel(path, header=[0, 1])
+
+
+def _local_name(tag):
+    # tag without namespace, transitional and strict OOXML files differ in it
+    return tag.rsplit('}', 1)[-1]
+
+
+def _get_text(element):
+    # text of a shared or inline string, rich text runs included, phonetic
+    # hints not
+    parts = []
+    for child in element:
+        name = _local_name(child.tag)
+        if name == 't':
+            parts.append(child.text or '')
+        elif name == 'r':
+            parts.extend(t.text or '' for t in child if _local_name(t.tag) == 't')
+    return ''.join(parts)
+
+
+def _get_column_index(reference):
+    # zero based column of a cell reference like `AB2`
+    index = 0
+    for char in reference:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - ord('A') + 1
+    return index - 1
+
+
+def _get_workbook_parts(workbook):
+    """
+    Returns the paths of the first sheet, the one `load_workbook` lists
+    first, and of the shared strings in the zip file of an xlsx workbook.
+    """
+    targets, shared_strings = {}, 'xl/sharedStrings.xml'
+    with workbook.open('xl/_rels/workbook.xml.rels') as f:
+        for element in ElementTree.parse(f).getroot():
+            target = element.get('Target', '')
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join('xl', target))
+            targets[element.get('Id')] = target
+            if element.get('Type', '').endswith('/sharedStrings'):
+                shared_strings = target
+    with workbook.open('xl/workbook.xml') as f:
+        for _, element in ElementTree.iterparse(f):
+            if _local_name(element.tag) == 'sheet':
+                relation = next(
+                    value for key, value in element.items() if key.endswith('}id')
+                )
+                return targets[relation], shared_strings
+    raise ValueError('workbook without sheets')
+
+
+def _read_header_cells(sheet, n_rows):
+    """
+    Streams the first `n_rows` rows of a sheet part and stops at the next row.
+
+    Returns:
+        dict of `(row, column): (type, text)` of the cells with a value
+    """
+    cells = {}
+    row = column = 0
+    for event, element in ElementTree.iterparse(sheet, events=('start', 'end')):
+        name = _local_name(element.tag)
+        if event == 'start':
+            if name == 'row':
+                row = int(element.get('r', row + 1))
+                if row > n_rows:
+                    break
+                column = 0
+            continue
+        if name == 'c':
+            reference = element.get('r')
+            if reference:
+                column = _get_column_index(reference)
+            cell_type = element.get('t')
+            for child in element:
+                child_name = _local_name(child.tag)
+                if child_name == 'is':
+                    cells[row, column] = (cell_type, _get_text(child))
+                elif child_name == 'v':
+                    cells[row, column] = (cell_type, child.text or '')
+            column += 1
+            element.clear()
+        elif name == 'row':
+            element.clear()
+    return cells
+
+
+def _read_shared_strings(workbook, path, indices):
+    # only the strings up to the largest of `indices` are parsed
+    strings = {}
+    if not indices or path not in workbook.namelist():
+        return strings
+    last = max(indices)
+    with workbook.open(path) as f:
+        index = 0
+        for _, element in ElementTree.iterparse(f):
+            if _local_name(element.tag) != 'si':
+                continue
+            if index in indices:
+                strings[index] = _get_text(element)
+            element.clear()
+            if index == last:
+                break
+            index += 1
+    return strings
+
+
+def sniff_workbook_header(path, group, column):
+    """
+    Checks whether the first sheet of a workbook has a `column` below the
+    (possibly merged) `group` header cell. The sheet XML is streamed from the
+    zip file and parsing stops after the second row, as do the shared
+    strings after the last one used in these rows, so time and memory do
+    not depend on the size of the sheet.
+    """
+    with zipfile.ZipFile(path) as workbook:
+        sheet_path, shared_strings_path = _get_workbook_parts(workbook)
+        with workbook.open(sheet_path) as sheet:
+            cells = _read_header_cells(sheet, 2)
+        strings = _read_shared_strings(
+            workbook,
+            shared_strings_path,
+            {int(text) for cell_type, text in cells.values() if cell_type == 's'},
+        )
+    rows = [{}, {}]
+    for (row, cell_column), (cell_type, text) in cells.items():
+        rows[row - 1][cell_column] = (
+            strings.get(int(text)) if cell_type == 's' else text
+        )
+    n_columns = max((max(row, default=-1) + 1 for row in rows), default=0)
+    groups, columns = ([row.get(idx) for idx in range(n_columns)] for row in rows)
+
+    # merged group cells only carry their value in the first cell, like
+    # pandas we fill it forward over the following empty cells
+    current_group = None
+    for group_value, column_value in zip(groups, columns):
+        if group_value is not None:
+            current_group = group_value
+        if current_group == group and column_value == column:
+            return True
+    return False
+
+
+def get_fingerprint(content, version=None):
+    return hashlib.sha256(f'{version}\n{content}'.encode()).hexdigest()
+
+
+def serialize_archive(entity, version=None):
+    """
+    Serializes a section like `create_archive` does and returns the content
+    together with its fingerprint, a hash of the content and `version`.
+    """
+    content = json.dumps({'data': entity.m_to_dict(with_root_def=True)})
+    return content, get_fingerprint(content, version)
+
+
+def write_archives(archive, entries, version=None, previous_fingerprints=None):
+    """
+    Writes `(file_name, section)` pairs as child archives of the upload, like
+    `create_archive` does for a single section. The sections are serialized
+    and written one at a time in the order of `entries`, so only one
+    serialized archive is held in memory.
+
+    Existing files are only rewritten if they still have the fingerprint
+    recorded in `previous_fingerprints` and the section changed, files that
+    were edited in the upload are left alone. Existing files without a
+    recorded fingerprint are kept as well and their current fingerprint is
+    recorded.
+
+    Returns:
+        the fingerprints of all entries, the recorded ones for files that
+        were not rewritten
+    """
+    if isinstance(archive.m_context, ClientContext):
+        return {}
+    if previous_fingerprints is None:
+        previous_fingerprints = {}
+
+    fingerprints = {}
+    for file_name, entity in entries:
+        content, fingerprint = serialize_archive(entity, version)
+        fingerprints[file_name] = fingerprint
+        previous = previous_fingerprints.get(file_name)
+        exists = archive.m_context.raw_path_exists(file_name)
+        if exists:
+            if previous == fingerprint:
+                continue
+            with archive.m_context.raw_file(file_name, 'r') as f:
+                current = get_fingerprint(f.read(), version)
+            if current != previous:
+                # edited in the upload or written before fingerprints were kept
+                fingerprints[file_name] = previous or current
+                continue
+        with archive.m_context.raw_file(file_name, 'w') as outfile:
+            outfile.write(content)
+        archive.m_context.process_updated_raw_file(file_name, allow_modify=exists)
+    return fingerprints
+
+
+def get_fingerprints_file_name(mainfile):
+    """
+    Returns the name of the file the fingerprints of the entries generated
+    from `mainfile`, the path of the workbook in the upload, are kept in.
+    """
+    return f'{mainfile}.fingerprints.json'
+
+
+def read_fingerprints(archive, file_name):
+    if isinstance(archive.m_context, ClientContext):
+        return {}
+    if not archive.m_context.raw_path_exists(file_name):
+        return {}
+    with archive.m_context.raw_file(file_name, 'r') as f:
+        return json.load(f)
+
+
+def write_fingerprints(archive, file_name, fingerprints):
+    if isinstance(archive.m_context, ClientContext):
+        return
+    with archive.m_context.raw_file(file_name, 'w') as f:
+        json.dump(fingerprints, f, indent=1, sort_keys=True)
+
+
+def compare_fingerprints(previous, current):
+    """
+    Returns the file names that were added, changed and removed between two
+    fingerprint dicts.
+    """
+    added = [f for f in current if f not in previous]
+    changed = [f for f in current if f in previous and previous[f] != current[f]]
+    removed = [f for f in previous if f not in current]
+    return added, changed, removed
+
+
+class DirectoryIndex:
+    """
+    Index of the `.txt` files of an upload directory by the prefix of their
+    first two `_` separated tokens. Lookups of files containing a token are
+    cached by `(prefix, token)`. `mtime_ns` is the modification time of the
+    directory when it was listed.
+    """
+
+    def __init__(self, paths, mtime_ns=None):
+        self.paths = set(paths)
+        self.mtime_ns = mtime_ns
+        self.by_prefix = {}
+        self.by_token = {}
+        for path in paths:
+            if not path.endswith('.txt'):
+                continue
+            prefix = '_'.join(path.split('_')[0:2])
+            self.by_prefix.setdefault(prefix, []).append(path)
+
+    def get(self, prefix, token):
+        key = (prefix, token)
+        if key not in self.by_token:
+            self.by_token[key] = [
+                path for path in self.by_prefix.get(prefix, []) if token in path
+            ]
+        return list(self.by_token[key])
+
+
+def invalidate_directory_index(upload_id=None):
+    if upload_id is None:
+        _directory_indices.clear()
+    else:
+        _directory_indices.pop(upload_id, None)
+
+
+def get_raw_directory_mtime(archive):
+    """
+    Returns the modification time of the upload's raw directory, None if the
+    context has no local raw directory, e.g. for published uploads or the
+    default context, which uses the current directory for every upload.
+    """
+    try:
+        raw_path = archive.m_context.raw_path()
+        if raw_path == os.path.curdir:
+            return None
+        return os.stat(raw_path).st_mtime_ns
+    except (AttributeError, OSError):
+        return None
+
+
+def get_sibling_files(archive, mainfile, prefix, token):
+    """
+    Returns the `.txt` files of the upload directory whose first two tokens
+    are `prefix` and that contain `token`. The directory is listed once per
+    upload and rebuilt whenever its modification time changes, i.e. files were
+    added, removed or renamed, or if `mainfile` is not part of it. Without a
+    modification time the directory is listed on every call.
+    """
+    upload_id = archive.metadata.upload_id
+    mtime_ns = get_raw_directory_mtime(archive)
+    index = _directory_indices.get(upload_id)
+    if (
+        index is None
+        or mtime_ns is None
+        or index.mtime_ns != mtime_ns
+        or os.path.basename(mainfile) not in index.paths
+    ):
+        index = DirectoryIndex(
+            [item.path for item in archive.m_context.upload_files.raw_directory_list()],
+            mtime_ns,
+        )
+        if mtime_ns is None:
+            _directory_indices.pop(upload_id, None)
+            return index.get(prefix, token)
+        _directory_indices[upload_id] = index
+        while len(_directory_indices) > DIRECTORY_INDEX_CACHE_SIZE:
+            _directory_indices.popitem(last=False)
+    _directory_indices.move_to_end(upload_id)
+    return index.get(prefix, token)
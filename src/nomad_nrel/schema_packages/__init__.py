@@ -1,7 +1,29 @@
 from nomad.config.models.plugins import SchemaPackageEntryPoint
+from pydantic import Field
 
 
 class NRELPackageEntryPoint(SchemaPackageEntryPoint):
+    parse_cache_directory: str | None = Field(
+        None,
+        description='Directory of the cache of parsed raw files. Defaults to '
+        'a directory in the NOMAD tmp directory.',
+    )
+    parse_cache_max_size: int = Field(
+        256 * 1024**2,
+        description='Maximum size of the cache of parsed raw files in bytes, '
+        'the least recently used files are evicted first. 0 disables the cache.',
+    )
+    eqe_grid_points: int = Field(
+        1000,
+        description='Number of points of the interpolated EQE spectra stored in '
+        'the archive.',
+    )
+    eqe_adaptive_grid: bool = Field(
+        False,
+        description='Place the points of the interpolated EQE spectra densely at '
+        'the absorption edge and sparsely elsewhere instead of evenly.',
+    )
+
     def load(self):
         from nomad_nrel.schema_packages.nrel_package import m_package
 
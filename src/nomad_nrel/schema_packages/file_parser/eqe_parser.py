@@ -24,10 +24,15 @@
 # Initially translated to Python by Christian Wolff
 
 
+import codecs
+import os
+from functools import lru_cache
 from io import StringIO
+from itertools import islice
 
 import numpy as np
 import pandas as pd
+from scipy.signal import savgol_filter
 
 # Constants
 temperature = 300  # in [°K]
@@ -39,12 +44,109 @@ VT = (k * T) / q  # % [V], 25.8mV thermal voltage at 300K
 c = 299792458  # % [m/s], speed of light c_0
 hc_eVnm = h_Js * c / q * 1e9  # % [eV nm]  Planck's constant
 
+# Bump when the output of the parsers changes, cached results of older
+# versions are ignored.
+PARSER_VERSION = 2
+# Number of bytes used to detect the encoding of a file.
+ENCODING_PREFIX_SIZE = 4096
 
-def interpolate_eqe(photon_energy_raw, eqe_raw):
-    photon_energy_interpolated = np.linspace(
-        min(photon_energy_raw), max(photon_energy_raw), 1000, endpoint=True
+# Interpolation grids, see `get_grid` and `get_adaptive_grids`
+GRID_POINTS = 1000
+GRID_CACHE_SIZE = 256
+ADAPTIVE_GRID_UNIFORM_FRACTION = 0.25
+ADAPTIVE_GRID_FILTER_WINDOW = 20
+
+# Urbach tail fit and radiative limit, see `get_radiative_parameters`
+URBACH_FILTER_WINDOW = 20
+MAX_URBACH_ENERGY = 0.5  # in [eV], larger values are not reported
+MAX_RADIATIVE_URBACH_ENERGY = 0.026  # in [eV], ~kB*T for T = 300K
+AM15G_FILE = os.path.join(os.path.dirname(__file__), 'AM15G.dat.txt')
+
+# Column delimiters of EQE files, in the order they are tried.
+EQE_DELIMITERS = ('\t', ',')
+
+# Number of columns per spectrum in exports with multiple spectra.
+SPECTRUM_COLUMNS = 6
+
+BOM_ENCODINGS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+
+def get_encoding(prefix):
+    """
+    Detects the encoding of a text file from the first bytes of the file:
+    a byte order mark, else UTF-8 if the bytes decode as UTF-8, else
+    latin-1.
+    """
+    for bom, encoding in BOM_ENCODINGS:
+        if prefix.startswith(bom):
+            return encoding
+    try:
+        # not final, the prefix may end within a multi-byte character
+        codecs.getincrementaldecoder('utf-8')().decode(prefix, final=False)
+    except UnicodeDecodeError:
+        return 'latin-1'
+    return 'utf-8'
+
+
+@lru_cache(maxsize=GRID_CACHE_SIZE)
+def get_grid(x_min, x_max, n_points=GRID_POINTS):
+    """
+    Returns a read-only grid of `n_points` evenly spaced values from `x_min`
+    to `x_max`. Grids are cached, spectra measured over the same range share
+    one array, so callers must copy it before writing to it.
+    """
+    grid = np.linspace(x_min, x_max, n_points)
+    grid.setflags(write=False)
+    return grid
+
+
+def get_adaptive_grids(grids, eqes):
+    """
+    Redistributes the points of the evenly spaced grids in the rows of
+    `grids` along the slope of the spectra `eqes` on them. Most points go to
+    the absorption edge, `ADAPTIVE_GRID_UNIFORM_FRACTION` of them are spread
+    evenly. The first and the last point stay the same.
+    """
+    if grids.shape[1] < 3:
+        return grids
+    slope = _rolling_mean(
+        np.abs(np.gradient(eqes, axis=1)), ADAPTIVE_GRID_FILTER_WINDOW
+    )
+    mean = slope.mean(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        density = np.where(mean > 0, slope / mean, 1)
+    density = (
+        1 - ADAPTIVE_GRID_UNIFORM_FRACTION
+    ) * density + ADAPTIVE_GRID_UNIFORM_FRACTION
+    # place the points at even steps of the integrated density
+    cumulative = np.cumsum((density[:, 1:] + density[:, :-1]) / 2, axis=1)
+    cumulative = np.pad(cumulative / cumulative[:, -1:], ((0, 0), (1, 0)))
+    steps = np.broadcast_to(np.linspace(0, 1, grids.shape[1]), grids.shape)
+    return interp_rows(steps, cumulative, grids)
+
+
+def interpolate_eqe(photon_energy_raw, eqe_raw, n_points=GRID_POINTS, adaptive=False):
+    """
+    Interpolates a spectrum onto `n_points` evenly spaced photon energies
+    between its lowest and highest one, or with `adaptive` onto a grid that
+    is dense at the absorption edge, see `get_adaptive_grids`. The evenly
+    spaced photon energies are the shared, read-only array of `get_grid`.
+    """
+    photon_energy_interpolated = get_grid(
+        float(min(photon_energy_raw)), float(max(photon_energy_raw)), n_points
     )
     eqe_interpolated = np.interp(photon_energy_interpolated, photon_energy_raw, eqe_raw)
+    if adaptive:
+        photon_energy_interpolated = get_adaptive_grids(
+            photon_energy_interpolated[None], eqe_interpolated[None]
+        )[0]
+        eqe_interpolated = np.interp(
+            photon_energy_interpolated, photon_energy_raw, eqe_raw
+        )
 
     return photon_energy_interpolated, eqe_interpolated
 
@@ -82,85 +184,441 @@ def arrange_eqe_columns(df):
     return photon_energy_raw, eqe_raw
 
 
-def read_file(file_path, header_lines=None):
+def sniff_eqe_file(lines, header_lines=0):
+    """
+    Finds the delimiter and the column names of an EQE file from its first
+    non-blank lines. Like `pd.read_csv`, blank lines are not counted. Tabs
+    are preferred over commas and, with `header_lines`, the column names are
+    expected in the last header line or else in the line after it.
+
+    Returns:
+        delimiter: the column delimiter
+        names: list of the column names, their indices without `header_lines`
+        data_start: index of the first line in `lines` after the column names
+    """
+    candidates = [(delimiter, None) for delimiter in EQE_DELIMITERS]
+    if header_lines:
+        candidates = [
+            (delimiter, row)
+            for row in (header_lines - 1, header_lines)
+            for delimiter in EQE_DELIMITERS
+        ]
+    # only the lines up to the last candidate for the column names are read
+    non_blank = list(
+        islice(
+            (idx for idx, line in enumerate(lines) if line.strip()),
+            header_lines + 1,
+        )
+    )
+    for delimiter, row in candidates:
+        if row is None:
+            # numbered columns, the first line only gives their number
+            n_columns = len(lines[non_blank[0]].split(delimiter)) if non_blank else 0
+            names, data_start = list(range(n_columns)), 0
+        elif row < len(non_blank):
+            names = [name.strip('"') for name in lines[non_blank[row]].split(delimiter)]
+            data_start = non_blank[row] + 1
+        else:
+            continue
+        if len(names) >= 2:
+            return delimiter, names, data_start
+    raise ValueError('Could not find two columns in the EQE file.')
+
+
+def read_eqe_values(lines, delimiter, n_columns):
     """
-    Reads the file and returns the columns in a pandas DataFrame `df`.
-    :return: df
-    :rtype: pandas.DataFrame
+    Converts the non-blank `lines` to a float64 array with `n_columns`
+    columns in one pass. Values that are not numbers become NaN, missing
+    values at the end of a line as well, additional values are ignored.
     """
-    if header_lines is None:
-        header_lines = 0
-    if header_lines == 0:  # in case you have a header
+    lines = [line for line in lines if line.strip()]
+    tokens = delimiter.join(lines).split(delimiter)
+    if len(tokens) == len(lines) * n_columns:
         try:
-            df = pd.read_csv(
-                file_path,
-                header=None,
-                sep='\t',
-            )
-            if len(df.columns) < 2:
-                raise IndexError
-        except IndexError:
-            df = pd.read_csv(file_path, header=None)
+            return np.array(tokens).astype(np.float64).reshape(len(lines), -1)
+        except ValueError:
+            pass
+    values = np.full((len(lines), n_columns), np.nan)
+    for row, line in zip(values, lines):
+        for idx, field in enumerate(line.split(delimiter)[:n_columns]):
+            try:
+                row[idx] = float(field)
+            except ValueError:
+                pass
+    return values
+
+
+def read_file(file_path, header_lines=None):
+    """
+    Reads an EQE file with the wavelength or photon energy in the first
+    column and the eqe in the second one or in the column `Calculated`.
+    The delimiter and the column names are sniffed from the first lines,
+    then the file is parsed once. Rows with values that are not numbers are
+    dropped.
+
+    Returns:
+        photon_energy_raw, eqe_raw, photon_energy, intensity, see
+        `arrange_eqe_columns` and `interpolate_eqe`
+    """
+    if hasattr(file_path, 'read'):
+        text = file_path.read()
     else:
-        try:
-            # header_lines - 1 assumes last header line is column names
-            df = pd.read_csv(file_path, header=int(header_lines - 1), sep='\t')
-            if len(df.columns) < 2:
-                raise IndexError
-        except IndexError:
-            try:  # wrong separator?
-                df = pd.read_csv(file_path, header=int(header_lines - 1))
-                if len(df.columns) < 2:
-                    raise IndexError
-            except IndexError:
-                try:
-                    df = pd.read_csv(file_path, header=int(header_lines), sep='\t')
-                    if len(df.columns) < 2:
-                        raise IndexError
-                except IndexError:
-                    df = pd.read_csv(file_path, header=int(header_lines))
-                    if len(df.columns) < 2:
-                        raise IndexError
-    df = df.apply(pd.to_numeric, errors='coerce')
-    df = df.dropna()
+        with open(file_path) as f:
+            text = f.read()
+    lines = text.splitlines()
+    delimiter, names, data_start = sniff_eqe_file(lines, int(header_lines or 0))
+    values = read_eqe_values(lines[data_start:], delimiter, len(names))
+    values = values[~np.isnan(values).any(axis=1)]
+    df = pd.DataFrame(values, columns=names)
     photon_energy_raw, eqe_raw = arrange_eqe_columns(df)
     photon_energy, intensity = interpolate_eqe(photon_energy_raw, eqe_raw)
     return photon_energy_raw, eqe_raw, photon_energy, intensity
 
 
+def interpolate_eqe_batch(
+    photon_energy_raw, eqe_raw, lengths, n_points=GRID_POINTS, adaptive=False
+):
+    """
+    Interpolates many spectra at once, each onto its own grid like
+    `interpolate_eqe`. The raw spectra are the columns of the 2-D arrays, of
+    which only the first `lengths` values are used.
+
+    Returns:
+        photon_energy_interpolated: 2-D array with one grid per row
+        eqe_interpolated: 2-D array with one spectrum per row
+    """
+    if not len(lengths):
+        return np.empty((0, n_points)), np.empty((0, n_points))
+    valid = np.arange(len(photon_energy_raw))[:, None] < lengths
+    x_min = np.where(valid, photon_energy_raw, np.inf).min(axis=0)
+    x_max = np.where(valid, photon_energy_raw, -np.inf).max(axis=0)
+    # usually the spectra of a file share one range, and thus one grid
+    ranges, inverse = np.unique(
+        np.stack([x_min, x_max], axis=1), axis=0, return_inverse=True
+    )
+    grids = np.stack([get_grid(*bounds, n_points) for bounds in ranges.tolist()])
+    photon_energy_interpolated = grids[inverse.ravel()]
+    eqe_interpolated = interp_rows(
+        photon_energy_interpolated, photon_energy_raw.T, eqe_raw.T, valid.T
+    )
+    if adaptive:
+        photon_energy_interpolated = get_adaptive_grids(
+            photon_energy_interpolated, eqe_interpolated
+        )
+        eqe_interpolated = interp_rows(
+            photon_energy_interpolated, photon_energy_raw.T, eqe_raw.T, valid.T
+        )
+    return photon_energy_interpolated, eqe_interpolated
+
+
+def interp_rows(x, xp, fp, valid=None):
+    """
+    Row-wise `np.interp` of 2-D arrays in a single call: row `i` of `x` is
+    interpolated on the points of row `i` of `xp` and `fp` that are `valid`.
+    Like `np.interp`, values outside of the points are clamped.
+    """
+    if valid is None:
+        valid = np.ones(xp.shape, dtype=bool)
+    x_min = np.where(valid, xp, np.inf).min(axis=1)
+    x_max = np.where(valid, xp, -np.inf).max(axis=1)
+    x = np.clip(x, x_min[:, None], x_max[:, None])
+    # shift the rows to disjoint ranges, so that they can be interpolated
+    # with a single call
+    shift = (np.max(x_max - x_min) + 1) * np.arange(len(xp)) - x_min
+    return np.interp(
+        x + shift[:, None], (xp + shift[:, None])[valid], np.asarray(fp)[valid]
+    )
+
+
+def _compact_columns(values):
+    # moves the finite values of every column to its start, in their order,
+    # and returns their number per column
+    finite = np.isfinite(values)
+    order = np.argsort(~finite, axis=0, kind='stable')
+    return np.take_along_axis(values, order, axis=0), finite.sum(axis=0)
+
+
+def read_spectra_multiple(filedata):
+    """
+    Reads an export with one spectrum per group of 6 columns, photon energy
+    (eV) or wavelength (nm) in the first and EQE (absolute or %) in the
+    second column of each group. All spectra are converted, ordered by
+    increasing photon energy and interpolated together on 2-D arrays.
+
+    Returns:
+        dict with the `spectra` that could be read and the `failures`, the
+        name of the first column and the reason for every spectrum that
+        could not be read
+    """
+    # the 4 lines below the column names are metadata
+    df = pd.read_csv(StringIO(filedata), sep='\t', skiprows=range(1, 5))
+    columns = [str(column) for column in df.columns]
+    starts = np.arange(0, len(columns), SPECTRUM_COLUMNS)
+
+    failures = [
+        {'name': columns[i], 'error': 'The spectrum has no EQE column.'}
+        for i in starts[starts + 1 >= len(columns)]
+    ]
+    starts = starts[starts + 1 < len(columns)]
+    values = (
+        df.iloc[:, np.concatenate([starts, starts + 1])]
+        .apply(pd.to_numeric, errors='coerce')
+        .to_numpy(np.float64)
+    )
+    x, n_x = _compact_columns(values[:, : len(starts)])
+    y, n_y = _compact_columns(values[:, len(starts) :])
+    readable = (n_x == n_y) & (n_x >= 3)
+    failures.extend(
+        {
+            'name': columns[i],
+            'error': f'The spectrum has {x_count} photon energy and {y_count} '
+            'EQE values, at least 3 of each are needed.',
+        }
+        for i, x_count, y_count in zip(
+            starts[~readable], n_x[~readable], n_y[~readable]
+        )
+    )
+    starts, lengths = starts[readable], n_x[readable]
+    x, y = x[:, readable], y[:, readable]
+    rows = np.arange(len(x))[:, None]
+    valid = rows < lengths
+
+    # check if energy (eV) or wavelength (nm)
+    with np.errstate(divide='ignore'):
+        x = np.where(
+            np.where(valid, x, -np.inf).max(axis=0, initial=-np.inf) > 10,
+            hc_eVnm / x,
+            x,
+        )
+    # check if EQE is given in (%), if so it's translated to abs. numbers
+    y = np.where(
+        np.where(valid, y, -np.inf).max(axis=0, initial=-np.inf) > 10, y / 100, y
+    )
+    # bring both arrays into correct order (i.e. w.r.t eV increasing)
+    # if one started with e.g. wavelength in increasing order
+    if len(x):
+        order = np.where(valid & (x[1] - x[2] > 0), lengths - 1 - rows, rows)
+        x = np.take_along_axis(x, order, axis=0)
+        y = np.take_along_axis(y, order, axis=0)
+
+    photon_energy, intensity = interpolate_eqe_batch(x, y, lengths)
+    spectra = [
+        {
+            'name': columns[start],
+            'photon_energy_raw': x[:length, idx],
+            'intensty_raw': y[:length, idx],
+            'photon_energy': photon_energy[idx],
+            'intensity': intensity[idx],
+        }
+        for idx, (start, length) in enumerate(zip(starts, lengths))
+    ]
+    return {'spectra': spectra, 'failures': failures}
+
+
 def read_file_multiple(filedata):
-    df = pd.read_csv(StringIO(filedata), sep='\t')
-    result = []
-    for i in range(0, len(df.columns), 6):
-        try:
-            x = np.array(df[df.columns[i]][4:], dtype=np.float64)
-            y = np.array(df[df.columns[i + 1]][4:], dtype=np.float64)
-
-            x = x[np.isfinite(x)]
-            y = y[np.isfinite(y)]
-            if any(x > 10):  # check if energy (eV) or wavelength (nm)
-                x = hc_eVnm / x
-            # check if EQE is given in (%), if so it's translated to abs.
-            # numbers
-            if any(y > 10):
-                y = y / 100
-
-            # bring both arrays into correct order (i.e. w.r.t eV increasing)
-            # if one started with e.g. wavelength in increasing order
-            # e.g. 300nm, 305nm,...
-            if x[1] - x[2] > 0:
-                x = np.flip(x)
-                y = np.flip(y)
-            photon_energy, intensity = interpolate_eqe(x, y)
-
-            result.append(
-                {
-                    'photon_energy_raw': x,
-                    'intensty_raw': y,
-                    'photon_energy': photon_energy,
-                    'intensity': intensity,
-                }
-            )
-        except Exception:
-            continue
-    return result
+    """
+    Returns the spectra of an export with one spectrum per group of 6
+    columns, see `read_spectra_multiple`.
+    """
+    return read_spectra_multiple(filedata)['spectra']
+
+
+def get_bandgaps(photon_energies, eqes):
+    """
+    Calculates the bandgaps of many interpolated spectra of the same length
+    at once, from the inflection point of the smoothed eqe like
+    `EQEAnalyzer.calculate_bandgap` does for one spectrum.
+
+    Returns:
+        array of bandgaps in eV
+    """
+    if not len(photon_energies):
+        return np.array([], dtype=np.float64)
+    x = np.vstack(photon_energies)
+    y = savgol_filter(np.vstack(eqes), 51, 4, mode='nearest', axis=1)
+    deqe = np.diff(y, axis=1) / np.diff(np.flip(-x, axis=1), axis=1)
+    return x[np.arange(len(x)), deqe.argmax(axis=1)]
+
+
+@lru_cache(maxsize=1)
+def get_am15g_spectrum():
+    """
+    Returns the photon energies (eV) and the photon flux of the AM 1.5G sun
+    spectrum.
+    """
+    spectrum = np.loadtxt(AM15G_FILE, delimiter=',', usecols=(1, 2))
+    return spectrum[:, 0], spectrum[:, 1]
+
+
+def _rolling_mean(values, window):
+    # row-wise centered rolling mean ignoring non-finite values, like
+    # pandas `rolling(window, min_periods=window // 4, center=True).mean()`
+    finite = np.isfinite(values)
+    sums = np.cumsum(np.where(finite, values, 0), axis=1)
+    counts = np.cumsum(finite, axis=1)
+    sums = np.pad(sums, ((0, 0), (1, 0)))
+    counts = np.pad(counts, ((0, 0), (1, 0)))
+    idx = np.arange(values.shape[1])
+    low = np.clip(idx - window // 2, 0, values.shape[1])
+    high = np.clip(idx - window // 2 + window, 0, values.shape[1])
+    count = counts[:, high] - counts[:, low]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = (sums[:, high] - sums[:, low]) / count
+    return np.where(count >= window // 4, mean, np.nan)
+
+
+def fit_urbach_tails(photon_energy, eqe, filter_window=URBACH_FILTER_WINDOW):
+    """
+    Fits the Urbach tails of many interpolated spectra at once, like
+    `EQEAnalyzer.fit_urbach_tail` does for one spectrum. The fit range of
+    every spectrum goes from a factor of 8 below to a factor of 2 above the
+    eqe at the maximum of the derivative of the smoothed log(eqe).
+
+    Returns:
+        dict with arrays of the Urbach energies `urbach_e` in eV, their
+        standard deviations `urbach_e_std`, the indices `start` and `stop`
+        of the fit range and the smoothed eqe `min_eqe_fit` at its start.
+        Values are NaN for spectra that could not be fitted.
+    """
+    rows = np.arange(len(eqe))
+    y = savgol_filter(eqe, 51, 4, mode='mirror', axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.diff(_rolling_mean(np.log(y), filter_window), axis=1)
+    has_slope = np.isfinite(slope).any(axis=1)
+    inflection = np.argmax(np.where(np.isfinite(slope), slope, -np.inf), axis=1) + 1
+    y_inflection = y[rows, inflection][:, None]
+    start = np.argmin(np.abs(y - y_inflection / 8), axis=1)
+    stop = np.argmin(np.abs(y - y_inflection * 2), axis=1)
+
+    # least squares fit of log(eqe) = x / urbach_e + m over [start, stop)
+    idx = np.arange(y.shape[1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_y = np.log(y)
+    in_fit = (idx >= start[:, None]) & (idx < stop[:, None])
+    n = in_fit.sum(axis=1)
+    fittable = has_slope & (n > 2) & ~(in_fit & ~np.isfinite(log_y)).any(axis=1)
+    x = np.where(in_fit, photon_energy, 0)
+    log_y = np.where(in_fit, log_y, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_mean = x.sum(axis=1) / n
+        y_mean = log_y.sum(axis=1) / n
+        dx = np.where(in_fit, photon_energy - x_mean[:, None], 0)
+        dy = np.where(in_fit, log_y - y_mean[:, None], 0)
+        sxx = (dx**2).sum(axis=1)
+        a = (dx * dy).sum(axis=1) / sxx
+        residuals = np.where(in_fit, dy - a[:, None] * dx, 0)
+        a_std = np.sqrt((residuals**2).sum(axis=1) / (n - 2) / sxx)
+        urbach_e = 1 / a
+        urbach_e_std = a_std / a**2
+
+    invalid = ~fittable | ~np.isfinite(urbach_e)
+    return {
+        'urbach_e': np.where(invalid, np.nan, urbach_e),
+        'urbach_e_std': np.where(invalid, np.nan, urbach_e_std),
+        'start': start,
+        'stop': stop,
+        'min_eqe_fit': y[rows, start],
+    }
+
+
+def get_jsc(photon_energy, eqe):
+    """
+    Calculates the short circuit current densities of many interpolated
+    spectra at once from the product with the AM 1.5G spectrum.
+
+    Returns:
+        array of jsc in A m**(-2)
+    """
+    energy_am15, spectrum_am15 = get_am15g_spectrum()
+    flux = eqe * np.interp(photon_energy, energy_am15, spectrum_am15)
+    jsc = np.cumsum(
+        (flux[:, 1:] + flux[:, :-1]) / 2 * np.diff(photon_energy, axis=1), axis=1
+    )
+    return jsc.max(axis=1, initial=0) * q * 1e4
+
+
+def get_j0rad(photon_energy, eqe, urbach_tails):
+    """
+    Calculates the radiative saturation current densities of many
+    interpolated spectra at once, like `EQEAnalyzer.calculate_j0rad`. The
+    spectra are extended below the fit range with their Urbach tails and
+    weighted with the black body spectrum.
+
+    Returns:
+        array of j0rad in A m**(-2), NaN for spectra without an Urbach energy
+        below ~kB*T
+    """
+    rows = np.arange(len(eqe))
+    urbach_e = urbach_tails['urbach_e']
+    start, stop = urbach_tails['start'], urbach_tails['stop']
+    valid = (urbach_e > 0) & (urbach_e < MAX_RADIATIVE_URBACH_ENERGY)
+    if not valid.any():
+        return np.full(len(eqe), np.nan)
+
+    # the measured spectrum above the fit range ...
+    x_interp = np.linspace(
+        photon_energy[rows, stop], photon_energy.max(axis=1), 1000, axis=1
+    )
+    tail = np.arange(eqe.shape[1]) >= np.maximum(start, stop)[:, None]
+    y_interp = interp_rows(x_interp, photon_energy, eqe, tail)
+    above = y_interp >= urbach_tails['min_eqe_fit'][:, None]
+    valid &= above.any(axis=1)
+    above[~valid] = True
+    # ... without the points below the fit range, moved to the front
+    order = np.argsort(~above, axis=1, kind='stable')
+    x_interp = np.take_along_axis(x_interp, order, axis=1)
+    y_interp = np.take_along_axis(y_interp, order, axis=1)
+    above = np.take_along_axis(above, order, axis=1)
+
+    # ... and the Urbach tail below it
+    x_extrap = np.linspace(-1, 0, 500, endpoint=False) + x_interp[:, :1]
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        y_extrap = y_interp[:, :1] * np.exp(
+            (x_extrap - x_interp[:, :1]) / urbach_e[:, None]
+        )
+    x = np.concatenate([x_extrap, x_interp], axis=1)
+    y = np.concatenate([y_extrap, y_interp], axis=1)
+    points = np.concatenate([np.ones(x_extrap.shape, dtype=bool), above], axis=1)
+
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        phi_bb = (2 * np.pi * q**3 * x**2) / (h_Js**3 * c**2 * (np.exp(x / VT) - 1))
+        el = phi_bb * y
+        segments = (el[:, 1:] + el[:, :-1]) / 2 * np.diff(x, axis=1)
+    j0rad = np.where(points[:, 1:], segments, 0).sum(axis=1) * q
+    return np.where(valid, j0rad, np.nan)
+
+
+def get_radiative_parameters(photon_energies, eqes):
+    """
+    Calculates the Urbach energy, jsc, j0rad and radiative open circuit
+    voltage of many interpolated spectra of the same length at once,
+    following Krückemeier et al. (https://doi.org/10.1002/aenm.201902573)
+    like `EQEAnalyzer.eqe_dict` does for one spectrum.
+
+    Returns:
+        dict with arrays of `urbach_e` and `urbach_e_std` in eV, `jsc` and
+        `j0rad` in A m**(-2) and `voc_rad` in V, NaN where a value could not
+        be determined
+    """
+    if not len(photon_energies):
+        empty = np.array([], dtype=np.float64)
+        return dict.fromkeys(
+            ('urbach_e', 'urbach_e_std', 'jsc', 'j0rad', 'voc_rad'), empty
+        )
+    x = np.vstack(photon_energies)
+    y = np.vstack(eqes)
+    urbach_tails = fit_urbach_tails(x, y)
+    jsc = get_jsc(x, y)
+    j0rad = get_j0rad(x, y, urbach_tails)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        voc_rad = VT * np.log(jsc / j0rad)
+
+    urbach_e = urbach_tails['urbach_e']
+    reported = (urbach_e > 0) & (urbach_e < MAX_URBACH_ENERGY)
+    return {
+        'urbach_e': np.where(reported, urbach_e, np.nan),
+        'urbach_e_std': np.where(reported, urbach_tails['urbach_e_std'], np.nan),
+        'jsc': jsc,
+        'j0rad': j0rad,
+        'voc_rad': voc_rad,
+    }
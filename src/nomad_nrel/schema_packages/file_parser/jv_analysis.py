@@ -0,0 +1,167 @@
+#
+# Copyright The NOMAD Authors.
+#
+# This file is part of NOMAD. See https://nomad-lab.eu for further info.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import numpy as np
+
+JV_PARAMETERS = (
+    'open_circuit_voltage',
+    'short_circuit_current_density',
+    'fill_factor',
+    'efficiency',
+)
+
+
+def stack_curves(curves):
+    """
+    Stacks 1-D arrays of different length into one 2-D float64 array, padded
+    with NaN. Returns the stacked array and the length of every curve.
+    """
+    lengths = np.array([len(curve) for curve in curves], dtype=np.int64)
+    stacked = np.full((len(curves), max(lengths.max(initial=0), 1)), np.nan)
+    for idx, curve in enumerate(curves):
+        stacked[idx, : lengths[idx]] = curve
+    return stacked, lengths
+
+
+def _interpolate_at_zero(x, y):
+    # Linear interpolation of every row of y at x = 0, like
+    # scipy.interpolate.interp1d on the rows of x sorted in ascending order.
+    # Points where x or y is NaN, padding included, are left out. NaN for rows
+    # where 0 is outside of the range of x.
+    rows = np.arange(len(x))
+    finite = np.isfinite(x) & np.isfinite(y)
+    lengths = finite.sum(axis=1)
+    order = np.argsort(np.where(finite, x, np.inf), axis=1, kind='stable')
+    x = np.take_along_axis(x, order, axis=1)
+    y = np.take_along_axis(y, order, axis=1)
+    last = np.maximum(lengths - 1, 0)
+    valid = (lengths > 0) & (x[:, 0] <= 0) & (x[rows, last] >= 0)
+
+    below = np.sum(x < 0, axis=1)
+    low = np.maximum(below - 1, 0)
+    high = np.minimum(below, last)
+    x_low, x_high = x[rows, low], x[rows, high]
+    y_low, y_high = y[rows, low], y[rows, high]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.where(
+            x_high == x_low,
+            y_high,
+            y_low - x_low * (y_high - y_low) / (x_high - x_low),
+        )
+    return np.where(valid, result, np.nan)
+
+
+def get_jv_parameters_batch(voltages, current_densities):
+    """
+    Calculates the figures of merit of many current density (mA/cm**2)
+    voltage (V) curves in one vectorized pass, the same way as
+    `SolarCellJVCurve.cell_params` does for a single curve. The curves may
+    differ in length, points with a NaN voltage or current density are
+    ignored.
+
+    Returns:
+        dict with a float64 array for every name in `JV_PARAMETERS`, NaN for
+        curves that do not cross both axes.
+    """
+    voltage, _ = stack_curves(voltages)
+    current_density, _ = stack_curves(current_densities)
+    voc = _interpolate_at_zero(current_density, voltage)
+    jsc = _interpolate_at_zero(voltage, current_density)
+
+    power = voltage * current_density
+    rows = np.arange(len(power))
+    idx = np.where(
+        jsc >= 0,
+        np.argmax(np.where(np.isnan(power), -np.inf, power), axis=1),
+        np.argmin(np.where(np.isnan(power), np.inf, power), axis=1),
+    )
+    # like `cell_params`, a curve without Voc or Jsc has no parameters at all
+    invalid = np.isnan(voc) | np.isnan(jsc)
+    voc = np.where(invalid, np.nan, voc)
+    jsc = np.where(invalid, np.nan, np.abs(jsc))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fill_factor = np.abs(power[rows, idx] / (voc * jsc))
+    return dict(zip(JV_PARAMETERS, (voc, jsc, fill_factor, voc * fill_factor * jsc)))
+
+
+def get_jv_parameters(voltage, current_density):
+    """
+    Calculates the figures of merit of a single curve, see
+    `get_jv_parameters_batch`.
+
+    Returns:
+        Voc (V) open circuit voltage
+        Jsc (mA/cm**2) short circuit current density
+        FF fill factor in absolute values (0-1)
+        efficiency power conversion efficiency in percentage (0-100)
+        or None for all of them if the curve does not cross both axes.
+    """
+    parameters = get_jv_parameters_batch([voltage], [current_density])
+    values = [float(parameters[name][0]) for name in JV_PARAMETERS]
+    if not np.isfinite(values).all():
+        return None, None, None, None
+    return tuple(values)
+
+
+def parse_timestamps(timestamps):
+    """
+    Converts the timestamps of stability sweeps to floats in one pass,
+    timestamps that are not plain integers become NaN.
+    """
+    timestamps = np.asarray(timestamps, dtype=str)
+    values = np.full(len(timestamps), np.nan)
+    is_integer = np.char.isdigit(timestamps)
+    values[is_integer] = timestamps[is_integer].astype(np.int64)
+    return values
+
+
+def downsample_lttb(x, y, n_points):
+    """
+    Selects at most `n_points` points of a series with the
+    Largest-Triangle-Three-Buckets algorithm, which keeps the visual shape
+    of the series, peaks and drops included. The first and the last point
+    are always kept.
+
+    Returns:
+        the sorted indices of the selected points
+    """
+    n_values = len(x)
+    if n_points >= n_values or n_points < 3:
+        return np.arange(n_values)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # n_points - 2 buckets between the first and the last point
+    edges = np.linspace(1, n_values - 1, n_points - 1).astype(np.int64)
+    indices = np.empty(n_points, dtype=np.int64)
+    indices[0], indices[-1] = 0, n_values - 1
+    selected = 0
+    for bucket in range(n_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket < n_points - 3:
+            next_end = edges[bucket + 2]
+            next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs(
+            (x[selected] - next_x) * (y[start:end] - y[selected])
+            - (x[selected] - x[start:end]) * (next_y - y[selected])
+        )
+        selected = start + np.argmax(area)
+        indices[bucket + 1] = selected
+    return indices
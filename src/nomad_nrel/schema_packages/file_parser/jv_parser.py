@@ -16,85 +16,307 @@
 # limitations under the License.
 #
 
-import re
+import mmap
 from io import StringIO
 
 import numpy as np
 import pandas as pd
 
+# Bump when the output of the parsers changes, cached results of older
+# versions are ignored.
+PARSER_VERSION = 1
 
-def get_jv_data_nrel(filedata, file_name):
-    # Block to clean up some bad characters found in the file which gives
-    # trouble reading.
-
-    filedata = filedata.replace('²', '^2')
-
-    df_header = pd.read_csv(
-        StringIO(filedata),
-        skiprows=2,
-        nrows=15,
-        header=None,
-        sep=': ',
-        index_col=0,
-        encoding='unicode_escape',
-        engine='python',
-    )
-    df_curves = pd.read_csv(
-        StringIO(filedata),
-        header=17,
-        skiprows=[16],
-        sep='\t',
-        encoding='unicode_escape',
-        engine='python',
-    )
 
-    df_curves = df_curves.dropna(how='all', axis=1)
+def _get_header_value(line):
+    # value after the first ': ', missing values count as 0 like before
+    fields = line.split(': ')
+    if len(fields) < 2 or not fields[1]:
+        return '0'
+    return fields[1]
+
+
+def read_jv_file_nrel(filedata):
+    """
+    Splits an NREL JV file into its header values and the voltage and current
+    columns of the curve table, using plain string operations and a single
+    `np.loadtxt` call for the numbers. Tables with empty cells or short rows
+    are read with the pandas C parser instead, which gives NaN for them.
+
+    Lines are counted like the former `pd.read_csv` based reader did: blank
+    lines are ignored, the header consists of the 15 lines after the first
+    two lines of the file, the column names of the table are in line 17 when
+    line 16 is not counted.
+
+    Returns:
+        header: list of the 15 header values as strings
+        voltage: float64 array
+        current: float64 array
+    """
+    lines = filedata.splitlines()
+    header_lines = [line for line in lines[2:] if line.strip()][:15]
+    header = [_get_header_value(line) for line in header_lines]
+
+    table_lines = [line for idx, line in enumerate(lines) if idx != 16 and line.strip()]
+    columns = [column.strip() for column in table_lines[17].split('\t')]
+    usecols = [columns.index('Voltage'), columns.index('Current')]
+    if len(table_lines) <= 18:
+        return header, np.empty(0), np.empty(0)
+    try:
+        data = np.loadtxt(
+            table_lines[18:],
+            delimiter='\t',
+            usecols=usecols,
+            dtype=np.float64,
+            ndmin=2,
+        )
+    except ValueError:
+        # empty cells or short rows, the C parser reads them as NaN
+        data = pd.read_csv(
+            StringIO('\n'.join(table_lines[18:])),
+            sep='\t',
+            header=None,
+            names=range(len(columns)),
+            usecols=usecols,
+            dtype=np.float64,
+            engine='c',
+        )[usecols].to_numpy()
+    return header, data[:, 0], data[:, 1]
+
 
-    df_header.replace([np.inf, -np.inf, np.nan], 0, inplace=True)
+def get_jv_data_nrel(filedata, file_name):
+    header, voltage, current = read_jv_file_nrel(filedata)
 
     jv_dict = {}
-    jv_dict['active_area'] = float(df_header.iloc[7, 0].split(' ')[0])
-    jv_dict['intensity'] = float(df_header.iloc[1, 0]) * 100
+    jv_dict['active_area'] = float(header[7].split(' ')[0])
+    jv_dict['intensity'] = float(header[1]) * 100
 
     jv_dict['jv_curve'] = []
 
     jv_dict['jv_curve'].append(
         {
             'name': ' '.join(file_name.split('_')[3:7]),
-            'voltage': df_curves['Voltage'].values,
-            'current_density': df_curves['Current'].values,
+            'voltage': voltage,
+            'current_density': current,
         }
     )
 
     return jv_dict
 
 
-def get_jv_data_stability_nrel(filedata):
-    # Block to clean up some bad characters found in the file which gives
-    # trouble reading.
-    header_string = re.search(r'\* HEADER START \*[\S\n\s]+\* HEADER END \*', filedata)
+STABILITY_COLUMNS = ('current', 'voltage', 'time')
+
+
+def _read_stability_row(line, row):
+    fields = line.split('\t')[: len(STABILITY_COLUMNS)]
+    try:
+        row[: len(fields)] = fields
+    except ValueError:
+        for idx, field in enumerate(fields):
+            try:
+                row[idx] = float(field)
+            except ValueError:
+                row[idx] = np.nan
+
+
+def _read_key_value(line, key_start, fields):
+    # adds a `key: value` line to `fields`, lines without ': ' are skipped
+    line_split = line.split(': ')
+    if len(line_split) > 1:
+        fields[line_split[0][key_start:]] = line_split[1]
+
+
+def read_jv_stability_header_nrel(lines):
+    """
+    Reads the `key: value` lines between `HEADER START` and `HEADER END`
+    from the line iterator `lines` and stops after the header.
+    """
+    header = {}
+    in_header = False
+    for raw_line in lines:
+        line = raw_line.rstrip('\r\n')
+        if '* HEADER START *' in line:
+            in_header = True
+        elif '* HEADER END *' in line:
+            break
+        elif in_header:
+            _read_key_value(line, 3, header)
+    return header
+
+
+def iter_jv_stability_curves_nrel(lines, chunk_size=1024):
+    """
+    Yields the sweeps of a stability log from the line iterator `lines` in a
+    single pass. Every sweep is a dict with the `key: value` lines of its test
+    header and `data`, a dict of float64 arrays for `STABILITY_COLUMNS`.
+    Rows are collected in a preallocated buffer that grows by `chunk_size`,
+    only one sweep is held in memory at a time.
+    """
+    buffer = np.empty((chunk_size, len(STABILITY_COLUMNS)))
+    curve = None
+    n_rows = 0
+    state = 'search'
+    for raw_line in lines:
+        line = raw_line.rstrip('\r\n')
+        if state == 'test_header':
+            if '* END TEST HEADER *' in line:
+                state = 'data'
+            else:
+                _read_key_value(line, 2, curve)
+            continue
+        if state == 'data':
+            if line.count('\t') >= 2:
+                if n_rows == len(buffer):
+                    buffer = np.resize(buffer, (n_rows + chunk_size, buffer.shape[1]))
+                _read_stability_row(line, buffer[n_rows])
+                n_rows += 1
+                continue
+            if not line and not n_rows:
+                continue
+            if n_rows:
+                curve['data'] = {
+                    column: buffer[:n_rows, idx].copy()
+                    for idx, column in enumerate(STABILITY_COLUMNS)
+                }
+                yield curve
+            state = 'search'
+        if '* START TEST HEADER *' in line:
+            curve = {}
+            n_rows = 0
+            state = 'test_header'
+
+    if state == 'data' and n_rows:
+        curve['data'] = {
+            column: buffer[:n_rows, idx].copy()
+            for idx, column in enumerate(STABILITY_COLUMNS)
+        }
+        yield curve
+
+
+def _line_end(buffer, pos):
+    # start of the line after the one containing `pos`
+    end = buffer.find(b'\n', pos)
+    return len(buffer) if end == -1 else end + 1
+
+
+def _line_start(buffer, pos, lower):
+    # start of the line containing `pos`, but not before `lower`
+    return max(buffer.rfind(b'\n', lower, pos) + 1, lower)
+
+
+def _decode_lines(buffer, start, end):
+    text = bytes(buffer[start:end]).decode()
+    lines = text.split('\n')
+    if text.endswith('\n') or not text:
+        lines.pop()
+    return [line.rstrip('\r') for line in lines]
+
+
+def _read_stability_rows_buffer(block, n_rows):
+    # fast path for blocks where every row has exactly the three columns
+    tokens = block.replace(b'\r', b'').replace(b'\n', b'\t').split(b'\t')
+    if block.endswith(b'\n'):
+        tokens.pop()
+    if len(tokens) == n_rows * len(STABILITY_COLUMNS):
+        try:
+            return np.array(tokens).astype(np.float64).reshape(n_rows, -1)
+        except ValueError:
+            pass
+    rows = np.empty((n_rows, len(STABILITY_COLUMNS)))
+    for row, line in zip(rows, block.decode().split('\n')):
+        _read_stability_row(line.rstrip('\r'), row)
+    return rows
+
+
+def _find_stability_rows(buffer, start):
+    # returns the end of the block of rows (lines with at least two tabs)
+    # starting at `start` and the number of rows
+    end = buffer.find(b'* START TEST HEADER *', start)
+    end = len(buffer) if end == -1 else _line_start(buffer, end, start)
+    # the rows usually end with a blank line
+    for blank_line in (b'\n\n', b'\n\r\n'):
+        blank = buffer.find(blank_line, start, end)
+        if blank != -1:
+            end = blank + 1
+    if end == start:
+        return start, 0
+    block = np.frombuffer(buffer, np.uint8, count=end - start, offset=start)
+    newlines = np.flatnonzero(block == ord('\n'))
+    if not len(newlines) or newlines[-1] != len(block) - 1:
+        newlines = np.append(newlines, len(block))
+    tabs = np.cumsum(block == ord('\t'))
+    tabs_per_line = np.diff(tabs[np.minimum(newlines, len(block) - 1)], prepend=0)
+    short = np.flatnonzero(tabs_per_line < 2)
+    if not len(short):
+        return end, len(newlines)
+    n_rows = short[0]
+    return (start if n_rows == 0 else int(newlines[n_rows - 1]) + 1 + start), n_rows
+
+
+def read_jv_stability_buffer_nrel(buffer):
+    """
+    Reads a stability log from a bytes-like object, e.g. a memory map of the
+    raw file, with the same result as `get_jv_data_stability_nrel`. Header
+    and sweeps are located by byte offset and only the text of the headers
+    is decoded. The rows of every sweep are converted straight from the
+    buffer, so memory use stays close to the size of the arrays.
+    """
+    header_end = buffer.find(b'* HEADER END *')
+    header_start = buffer.find(b'* HEADER START *', 0, max(header_end, 0))
+    if header_end == -1:
+        header_end = len(buffer)
     data = {}
-    for line in header_string.group().split('\n')[1:-1]:
-        line_split = line.split(': ')
-        data.update({line_split[0][3:]: line_split[1]})
+    if header_start != -1:
+        start = _line_end(buffer, header_start)
+        end = _line_start(buffer, header_end, start)
+        for line in _decode_lines(buffer, start, end):
+            _read_key_value(line, 3, data)
     data['curves'] = []
-    pattern = re.compile(
-        r'(\* START TEST HEADER \*[\S\n\s]+?\* END TEST HEADER \*\*\*\*\*\*\*\n\n(.*\t.*\t.*\n)+)'
-    )  # noqa E501
-
-    for m in pattern.finditer(filedata):
-        tmp = {}
-        for line in m.group().split('\n')[1:5]:
-            line_split = line.split(': ')
-            tmp.update({line_split[0][2:]: line_split[1]})
-
-        table = '\n'.join(m.group().split('\n')[7:])
-        df = pd.read_csv(
-            StringIO(table), sep='\t', names=['current', 'voltage', 'time']
-        )
-        tmp['data'] = df
-        data['curves'].append(tmp)
+    if header_end == len(buffer):
+        return data
 
+    pos = _line_end(buffer, header_end)
+    while True:
+        start = buffer.find(b'* START TEST HEADER *', pos)
+        if start == -1:
+            break
+        start = _line_end(buffer, start)
+        end = buffer.find(b'* END TEST HEADER *', start)
+        end = len(buffer) if end == -1 else _line_start(buffer, end, start)
+        curve = {}
+        for line in _decode_lines(buffer, start, end):
+            _read_key_value(line, 2, curve)
+        if end == len(buffer):
+            break
+
+        pos = _line_end(buffer, end)
+        # skip blank lines before the rows
+        while pos < len(buffer) and not buffer[pos : _line_end(buffer, pos)].strip(
+            b'\r\n'
+        ):
+            pos = _line_end(buffer, pos)
+        rows_end, n_rows = _find_stability_rows(buffer, pos)
+        if n_rows:
+            rows = _read_stability_rows_buffer(bytes(buffer[pos:rows_end]), n_rows)
+            curve['data'] = {
+                column: rows[:, idx].copy()
+                for idx, column in enumerate(STABILITY_COLUMNS)
+            }
+            data['curves'].append(curve)
+        pos = rows_end
+    return data
+
+
+def get_jv_data_stability_nrel(filedata):
+    """
+    Reads a stability log from a string, a text file handle or a bytes-like
+    object. Returns the header values and the list of sweeps in `curves`, see
+    `iter_jv_stability_curves_nrel`.
+    """
+    if isinstance(filedata, bytes | bytearray | memoryview | mmap.mmap):
+        return read_jv_stability_buffer_nrel(filedata)
+    lines = StringIO(filedata) if isinstance(filedata, str) else iter(filedata)
+    data = read_jv_stability_header_nrel(lines)
+    data['curves'] = list(iter_jv_stability_curves_nrel(lines))
     return data
 
 
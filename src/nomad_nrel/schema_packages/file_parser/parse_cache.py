@@ -0,0 +1,221 @@
+#
+# Copyright The NOMAD Authors.
+#
+# This file is part of NOMAD. See https://nomad-lab.eu for further info.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import hashlib
+import io
+import json
+import mmap
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+META_KEY = '__meta__'
+ARRAY_KEY = '__array__'
+# `encoding` for parsers that read the raw bytes instead of text
+BINARY = 'binary'
+# Fraction of `max_size` a full cache is shrunk to, so that the directory is
+# not scanned again on every following store.
+EVICTION_TARGET = 0.8
+
+
+@contextmanager
+def map_file(f):
+    """
+    Memory-maps the binary file `f` read-only. Falls back to the content of
+    the file for files that cannot be mapped, e.g. empty files.
+    """
+    try:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, io.UnsupportedOperation):
+        yield f.read()
+        return
+    with buffer:
+        yield buffer
+
+
+def _split_arrays(value, arrays):
+    # replaces the arrays of a nested dict/list structure by placeholders
+    # `{ARRAY_KEY: [dtype, start, shape]}`, the flattened arrays are appended
+    # to the list of their dtype in `arrays`
+    if isinstance(value, np.ndarray):
+        dtype = value.dtype.str
+        chunks, size = arrays.get(dtype, ([], 0))
+        chunks.append(value.ravel())
+        arrays[dtype] = (chunks, size + value.size)
+        return {ARRAY_KEY: [dtype, size, list(value.shape)]}
+    if isinstance(value, dict):
+        return {key: _split_arrays(item, arrays) for key, item in value.items()}
+    if isinstance(value, list | tuple):
+        return [_split_arrays(item, arrays) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _join_arrays(value, arrays):
+    if isinstance(value, dict):
+        if ARRAY_KEY in value:
+            dtype, start, shape = value[ARRAY_KEY]
+            size = int(np.prod(shape))
+            return arrays[dtype][start : start + size].reshape(shape)
+        return {key: _join_arrays(item, arrays) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_join_arrays(item, arrays) for item in value]
+    return value
+
+
+class ParseCache:
+    """
+    On-disk cache of parsed raw files. Entries are keyed by the hash of the
+    file content, the parser and its version, and stored as `.npz` files
+    with the arrays of the result and a JSON description of the surrounding
+    dicts and lists. The least recently used entries are evicted once the
+    cache grows beyond `max_size` bytes, results larger than that are not
+    stored.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        # total size of the entries, None until the directory is scanned
+        self.size = None
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def get_key(data, parser, version):
+        key = hashlib.sha256(f'{parser}\n{version}\n'.encode())
+        key.update(data)
+        return key.hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def load(self, key):
+        """
+        Returns the cached result for `key` or None.
+        """
+        path = self.get_path(key)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                meta, dtypes = json.loads(str(npz[META_KEY]))
+                arrays = {dtype: npz[f'a{idx}'] for idx, dtype in enumerate(dtypes)}
+            os.utime(path)
+        except (OSError, KeyError, ValueError):
+            return None
+        return _join_arrays(meta, arrays)
+
+    def store(self, key, result):
+        """
+        Stores `result` under `key`, unless it is larger than the whole cache.
+        The directory is only scanned for eviction once the sizes of the
+        entries stored since the last scan exceed `max_size`.
+        """
+        arrays = {}
+        meta = _split_arrays(result, arrays)
+        # one array per dtype keeps the number of npz members small
+        dtypes = list(arrays)
+        description = json.dumps([meta, dtypes])
+        size = len(description) + sum(
+            chunk.nbytes for chunks, _ in arrays.values() for chunk in chunks
+        )
+        if size > self.max_size:
+            return
+        path = self.get_path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(
+                    f,
+                    **{META_KEY: np.array(description)},
+                    **{
+                        f'a{idx}': np.concatenate(arrays[dtype][0])
+                        for idx, dtype in enumerate(dtypes)
+                    },
+                )
+                size = f.tell()
+            try:
+                size -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        with self.lock:
+            if self.size is not None:
+                self.size += size
+            full = self.size is None or self.size > self.max_size
+        if full:
+            self.evict()
+
+    def evict(self):
+        """
+        Scans the cache and, if it is larger than `max_size` bytes, removes
+        the least recently used entries until it fits into `EVICTION_TARGET`
+        of `max_size`.
+        """
+        with self.lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith('.npz'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            total_size = sum(size for _, size, _ in entries)
+            if total_size > self.max_size:
+                target = self.max_size * EVICTION_TARGET
+                for _, size, path in sorted(entries):
+                    if total_size <= target:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    total_size -= size
+            self.size = total_size
+
+    def parse(self, data, parser, version, *args, encoding=None):
+        """
+        Returns `parser(text, *args)` for the text of the raw file `data`,
+        or for `data` itself with the `BINARY` encoding. The result comes from
+        the cache if the same bytes were parsed before with the same
+        arguments and `encoding` by the same `version` of the parser.
+        """
+        key = self.get_key(
+            data,
+            f'{parser.__module__}.{parser.__qualname__}{args}{encoding}',
+            version,
+        )
+        result = self.load(key)
+        if result is None:
+            if encoding != BINARY:
+                # decoded like a raw file opened in text mode
+                data = io.TextIOWrapper(io.BytesIO(data), encoding=encoding).read()
+            result = parser(data, *args)
+            try:
+                self.store(key, result)
+            except (OSError, TypeError, ValueError):
+                pass
+        return result
@@ -16,9 +16,13 @@
 # limitations under the License.
 #
 
+import os
 import random
 import string
+import sys
+from functools import lru_cache
 
+import numpy as np
 from baseclasses import (
     BaseMeasurement,
     BaseProcess,
@@ -55,7 +59,9 @@ from baseclasses.wet_chemical_deposition import (
     SpinCoating,
     WetChemicalDeposition,
 )
-from nomad.datamodel.data import EntryData
+from nomad.config import config
+from nomad.datamodel.data import ArchiveSection, EntryData
+from nomad.datamodel.metainfo.eln import add_band_gap, add_solar_cell
 from nomad.datamodel.metainfo.plot import PlotlyFigure, PlotSection
 from nomad.metainfo import (
     Quantity,
@@ -63,9 +69,25 @@ from nomad.metainfo import (
     Section,
     SubSection,
 )
+from nomad.units import ureg
+
+from nomad_nrel.schema_packages.file_parser.jv_analysis import (
+    JV_PARAMETERS,
+    downsample_lttb,
+    get_jv_parameters_batch,
+    parse_timestamps,
+)
+from nomad_nrel.schema_packages.file_parser.parse_cache import (
+    BINARY,
+    ParseCache,
+    map_file,
+)
 
 m_package = SchemaPackage()
 
+ENTRY_POINT_ID = 'nomad_nrel.schema_packages:nrel_package'
+DEFAULT_PARSE_CACHE_MAX_SIZE = 256 * 1024**2
+
 
 # %% ####################### Entities
 
@@ -434,6 +456,124 @@ class NREL_LaserScribing(LaserScribing, EntryData):
     )
 
 
+def get_package_option(name, default):
+    try:
+        return getattr(config.get_plugin_entry_point(ENTRY_POINT_ID), name)
+    except (AttributeError, KeyError):
+        return default
+
+
+@lru_cache
+def _get_parse_cache(directory, max_size):
+    return ParseCache(directory, max_size)
+
+
+def get_parse_cache():
+    """
+    Returns the cache of parsed raw files configured for the schema package,
+    or None if it is disabled or cannot be created.
+    """
+    max_size = get_package_option('parse_cache_max_size', DEFAULT_PARSE_CACHE_MAX_SIZE)
+    if not max_size:
+        return None
+    directory = get_package_option('parse_cache_directory', None)
+    if directory is None:
+        directory = os.path.join(config.fs.tmp, 'nomad_nrel_parse_cache')
+    try:
+        return _get_parse_cache(directory, max_size)
+    except OSError:
+        return None
+
+
+def parse_raw_file(archive, file, parser, *args, binary=False, encoding=None):
+    """
+    Parses the text of a raw file of the upload with `parser(text, *args)`.
+    Results are cached by file content and the `PARSER_VERSION` of the
+    parser's module. With `binary`, the parser gets a read-only memory map
+    of the file instead of its text.
+    """
+    cache = get_parse_cache()
+    if cache is None and not binary:
+        with archive.m_context.raw_file(file, 'tr', encoding=encoding) as f:
+            return parser(f.read(), *args)
+    with archive.m_context.raw_file(file, 'rb') as f, map_file(f) as data:
+        if cache is None:
+            return parser(data, *args)
+        version = sys.modules[parser.__module__].PARSER_VERSION
+        return cache.parse(
+            data, parser, version, *args, encoding=BINARY if binary else encoding
+        )
+
+
+def read_raw_files(archive, files, parser):
+    """
+    Parses raw files of the upload with `parser(text, file_name)`, see
+    `parse_raw_file`.
+
+    Returns:
+        the results of the files that could be read, in the order of `files`
+        the `(file_name, exception)` pairs of the files that could not
+    """
+    results, failures = [], []
+    for file in files:
+        try:
+            results.append(parse_raw_file(archive, file, parser, file))
+        except Exception as e:
+            failures.append((file, e))
+    return results, failures
+
+
+def get_jv_curve_parameters(voltages, current_densities, logger):
+    """
+    Calculates the figures of merit of all curves in one vectorized pass.
+    Returns one dict of quantity values per curve, empty for curves whose
+    parameters could not be determined.
+    """
+    parameters = get_jv_parameters_batch(voltages, current_densities)
+    values = np.column_stack(list(parameters.values()))
+    valid = np.isfinite(values).all(axis=1)
+    if not valid.all():
+        logger.warning(
+            'Could not determine the JV parameters of some curves.',
+            n_curves=int((~valid).sum()),
+        )
+    return [
+        dict(zip(parameters, row)) if ok else {}
+        for row, ok in zip(values.tolist(), valid)
+    ]
+
+
+def update_jv_results(archive, jv_curves):
+    """
+    Updates the solar cell results from the last of the curves with
+    precomputed parameters whose parameters could be determined.
+    """
+    valid = [jv_curve for jv_curve in jv_curves if jv_curve.efficiency is not None]
+    if not valid:
+        return
+    add_solar_cell(archive)
+    valid[-1].update_results(archive)
+
+
+def update_jv_results_from_sweeps(archive, sweeps):
+    """
+    Updates the solar cell results from the last of compactly stored sweeps
+    whose parameters could be determined, like `update_jv_results`.
+    """
+    if not sweeps.n_sweeps:
+        return
+    values = [sweeps.m_get(name) for name in JV_PARAMETERS]
+    magnitudes = [getattr(value, 'magnitude', value) for value in values]
+    valid = np.flatnonzero(np.isfinite(np.column_stack(magnitudes)).all(axis=1))
+    if not len(valid):
+        return
+    add_solar_cell(archive)
+    solar_cell = archive.results.properties.optoelectronic.solar_cell
+    for name, value in zip(JV_PARAMETERS, values):
+        setattr(solar_cell, name, value[valid[-1]])
+    solar_cell.illumination_intensity = sweeps.light_intensity[valid[-1]]
+
+
 class NREL_JVmeasurement(JVMeasurement, EntryData):
     m_def = Section(
         a_eln=dict(
@@ -492,34 +632,80 @@ class NREL_JVmeasurement(JVMeasurement, EntryData):
             get_jv_data_nrel,
         )
 
+        jv_dicts = []
         if self.data_files:
-            curves = []
-            for file in self.data_files:
-                with archive.m_context.raw_file(file, 'tr') as f:
-                    jv_dict = get_jv_data_nrel(f.read(), file)
-                    curves.extend(jv_dict['jv_curve'])
-            jv_dict['jv_curve'] = curves
+            jv_dicts, failures = read_raw_files(
+                archive, self.data_files, get_jv_data_nrel
+            )
+            for file, error in failures:
+                logger.warning(
+                    'Could not read JV file.', data_file=file, exc_info=error
+                )
+        if jv_dicts:
+            jv_dict = jv_dicts[-1]
+            jv_dict['jv_curve'] = [
+                curve for file_dict in jv_dicts for curve in file_dict['jv_curve']
+            ]
 
             self.active_area = (
                 jv_dict['active_area'] if 'active_area' in jv_dict else None
             )
             self.intensity = jv_dict['intensity'] if 'intensity' in jv_dict else None
 
+            parameters = get_jv_curve_parameters(
+                [curve['voltage'] for curve in jv_dict['jv_curve']],
+                [curve['current_density'] for curve in jv_dict['jv_curve']],
+                logger,
+            )
             jv_curve = []
-            for curve_idx, curve in enumerate(jv_dict['jv_curve']):
+            for curve, curve_parameters in zip(jv_dict['jv_curve'], parameters):
                 jv_set = SolarCellJVCurveCustom(
                     cell_name=curve['name'],
                     voltage=curve['voltage'],
                     current_density=curve['current_density'],
+                    **curve_parameters,
                 )
-                jv_set.normalize(archive, logger)
                 jv_curve.append(jv_set)
 
             self.jv_curve = jv_curve
+            update_jv_results(archive, jv_curve)
 
         super().normalize(archive, logger)
 
 
+class NREL_JVStabilitySweeps(ArchiveSection):
+    """
+    All sweeps of a stability measurement stored column-wise. The points of
+    sweep `i` are `voltage[offsets[i]:offsets[i + 1]]` and
+    `current_density[offsets[i]:offsets[i + 1]]`, all other quantities have
+    one value per sweep.
+    """
+
+    m_def = Section(label_quantity='n_sweeps')
+
+    n_sweeps = Quantity(type=int)
+
+    timestamp = Quantity(type=str, shape=['*'])
+
+    light_intensity = Quantity(type=np.dtype(np.float64), shape=['*'], unit='mW/cm**2')
+
+    offsets = Quantity(type=np.dtype(np.int64), shape=['*'])
+
+    voltage = Quantity(type=np.dtype(np.float64), shape=['*'], unit='V')
+
+    current_density = Quantity(type=np.dtype(np.float64), shape=['*'], unit='mA/cm^2')
+
+    open_circuit_voltage = Quantity(type=np.dtype(np.float64), shape=['*'], unit='V')
+
+    short_circuit_current_density = Quantity(
+        type=np.dtype(np.float64), shape=['*'], unit='mA / cm**2'
+    )
+
+    fill_factor = Quantity(type=np.dtype(np.float64), shape=['*'])
+
+    efficiency = Quantity(type=np.dtype(np.float64), shape=['*'])
+
+
 class NREL_JVmeasurementStability(JVMeasurement, PlotSection, EntryData):
     m_def = Section(
         a_eln=dict(
@@ -539,6 +725,8 @@ class NREL_JVmeasurementStability(JVMeasurement, PlotSection, EntryData):
                 order=[
                     'name',
                     'data_file',
+                    'compact_storage',
+                    'max_plot_points',
                     'active_area',
                     'intensity',
                     'integration_time',
@@ -551,6 +739,29 @@ class NREL_JVmeasurementStability(JVMeasurement, PlotSection, EntryData):
         ),
     )
 
+    compact_storage = Quantity(
+        type=bool,
+        default=False,
+        description="""
+            Store all sweeps in one column-wise block in `sweeps` instead of
+            one `jv_curve` section per sweep. Recommended for long tests.
+        """,
+        a_eln=dict(component='BoolEditQuantity'),
+    )
+
+    max_plot_points = Quantity(
+        type=int,
+        default=1000,
+        description="""
+            Maximum number of points of the efficiency over time figure, the
+            series is downsampled to this budget. The full resolution data
+            stays in `jv_curve` or `sweeps`. 0 keeps all points.
+        """,
+        a_eln=dict(component='NumberEditQuantity'),
+    )
+
+    sweeps = SubSection(section_def=NREL_JVStabilitySweeps)
+
     def normalize(self, archive, logger):
         import plotly.graph_objects as go
         from baseclasses.solar_energy.jvmeasurement import (
@@ -562,34 +773,73 @@ class NREL_JVmeasurementStability(JVMeasurement, PlotSection, EntryData):
         )
 
         if self.data_file:
-            with archive.m_context.raw_file(self.data_file, 'tr') as f:
-                jv_dict = get_jv_data_stability_nrel(f.read())
+            jv_dict = parse_raw_file(
+                archive,
+                self.data_file,
+                get_jv_data_stability_nrel,
+                binary=True,
+            )
 
-            jv_curve = []
-            for curve_idx, curve in enumerate(jv_dict['curves']):
-                jv_set = SolarCellJVCurveCustom(
-                    light_intensity=100 * float(curve['Light']),
-                    cell_name=curve['Timestamp'],
-                    voltage=curve['data']['voltage'] * -1,
-                    current_density=curve['data']['current']
-                    * 1000
-                    / float(jv_dict['PxSize']),
+            curves = jv_dict['curves']
+            voltages = [curve['data']['voltage'] * -1 for curve in curves]
+            current_densities = [
+                curve['data']['current'] * 1000 / float(jv_dict['PxSize'])
+                for curve in curves
+            ]
+            if self.compact_storage:
+                parameters = get_jv_parameters_batch(voltages, current_densities)
+                offsets = np.zeros(len(curves) + 1, dtype=np.int64)
+                offsets[1:] = np.cumsum([len(voltage) for voltage in voltages])
+
+                self.jv_curve = []
+                self.sweeps = NREL_JVStabilitySweeps(
+                    n_sweeps=len(curves),
+                    timestamp=[curve['Timestamp'] for curve in curves],
+                    light_intensity=[100 * float(curve['Light']) for curve in curves],
+                    offsets=offsets,
+                    voltage=np.concatenate(voltages) if curves else [],
+                    current_density=np.concatenate(current_densities) if curves else [],
+                    **parameters,
                 )
-                jv_set.normalize(archive, logger)
-                jv_curve.append(jv_set)
-
-            self.jv_curve = jv_curve
+                update_jv_results_from_sweeps(archive, self.sweeps)
+                timestamps = self.sweeps.timestamp
+                efficiencies = self.sweeps.efficiency
+            else:
+                parameters = get_jv_curve_parameters(
+                    voltages, current_densities, logger
+                )
+                jv_curve = []
+                for curve, voltage, current_density, curve_parameters in zip(
+                    curves, voltages, current_densities, parameters
+                ):
+                    jv_set = SolarCellJVCurveCustom(
+                        light_intensity=100 * float(curve['Light']),
+                        cell_name=curve['Timestamp'],
+                        voltage=voltage,
+                        current_density=current_density,
+                        **curve_parameters,
+                    )
+                    jv_curve.append(jv_set)
+
+                self.jv_curve = jv_curve
+                update_jv_results(archive, jv_curve)
+                self.sweeps = None
+                timestamps = [curve['Timestamp'] for curve in curves]
+                efficiencies = [p.get('efficiency', np.nan) for p in parameters]
+
+            times = parse_timestamps(timestamps)
+            efficiencies = np.asarray(efficiencies, dtype=np.float64)
+            plotted = np.isfinite(times) & np.isfinite(efficiencies)
+            times, efficiencies = times[plotted], efficiencies[plotted]
+            if self.max_plot_points:
+                indices = downsample_lttb(times, efficiencies, self.max_plot_points)
+                times, efficiencies = times[indices], efficiencies[indices]
 
             fig1 = go.Figure()
             fig1.add_trace(
                 go.Scatter(
-                    x=[
-                        int(x.get('cell_name'))
-                        if x.get('cell_name').isdigit()
-                        else None
-                        for x in self.jv_curve
-                    ],
-                    y=[x.get('efficiency') for x in self.jv_curve],
+                    x=times.tolist(),
+                    y=efficiencies.tolist(),
                     name='Efficiency over timestamps',
                     marker=dict(color='blue'),
                 )
@@ -606,6 +856,10 @@ class NREL_JVmeasurementStability(JVMeasurement, PlotSection, EntryData):
         super().normalize(archive, logger)
 
 
+def _with_unit(value, unit):
+    return None if value is None else value * unit
+
+
 class NREL_EQEmeasurement(EQEMeasurement, EntryData):
     m_def = Section(
         a_eln=dict(
@@ -637,33 +891,100 @@ class NREL_EQEmeasurement(EQEMeasurement, EntryData):
     )
 
     def normalize(self, archive, logger):
-        # from nomad_hysprint.schema_packages.file_parser.eqe_parser import (
-        #     read_file_multiple,
-        # )
-
-        # if self.data_file:
-        #     with archive.m_context.raw_file(self.data_file, 'br') as f:
-        #         encoding = get_encoding(f)
-        #     with archive.m_context.raw_file(
-        #         self.data_file, 'tr', encoding=encoding
-        #     ) as f:
-        #         data_list = read_file_multiple(f.read())
-        #     eqe_data = []
-        #     for d in data_list:
-        #         entry = SolarCellEQECustom(
-        #             photon_energy_array=d.get('photon_energy'),
-        #             raw_photon_energy_array=d.get('photon_energy_raw'),
-        #             eqe_array=d.get('intensity'),
-        #             raw_eqe_array=d.get('intensty_raw'),
-        #         )
-        #         entry.normalize(archive, logger)
-        #         eqe_data.append(entry)
-        #     self.eqe_data = eqe_data
-
-        # if eqe_data:
-        #     band_gaps = np.array([d.bandgap_eqe.magnitude for d in eqe_data])
-
-        #     add_band_gap(archive, band_gaps[np.isfinite(band_gaps)].mean())
+        from baseclasses.solar_energy.eqemeasurement import SolarCellEQECustom
+
+        from nomad_nrel.schema_packages.file_parser.eqe_parser import (
+            ENCODING_PREFIX_SIZE,
+            GRID_POINTS,
+            get_bandgaps,
+            get_encoding,
+            get_radiative_parameters,
+            hc_eVnm,
+            interpolate_eqe_batch,
+            read_spectra_multiple,
+        )
+
+        if self.data_file:
+            with archive.m_context.raw_file(self.data_file, 'br') as f:
+                encoding = get_encoding(f.read(ENCODING_PREFIX_SIZE))
+            try:
+                spectra = parse_raw_file(
+                    archive,
+                    self.data_file,
+                    read_spectra_multiple,
+                    encoding=encoding,
+                )
+            except UnicodeDecodeError:
+                # non UTF-8 characters after the prefix get_encoding looked at
+                spectra = parse_raw_file(
+                    archive,
+                    self.data_file,
+                    read_spectra_multiple,
+                    encoding='latin-1',
+                )
+            for failure in spectra['failures']:
+                logger.warning(
+                    'Could not read EQE spectrum.',
+                    spectrum=failure['name'],
+                    reason=failure['error'],
+                )
+            data_list = spectra['spectra']
+            photon_energies = [d['photon_energy'] for d in data_list]
+            eqes = [d['intensity'] for d in data_list]
+            band_gaps = get_bandgaps(photon_energies, eqes)
+            radiative = get_radiative_parameters(photon_energies, eqes)
+            # the analysis needs the default grid, the stored spectra may use
+            # a configured one
+            grid_points = get_package_option('eqe_grid_points', GRID_POINTS)
+            adaptive_grid = get_package_option('eqe_adaptive_grid', False)
+            if grid_points != GRID_POINTS or adaptive_grid:
+                # the raw spectra as padded columns, like read_spectra_multiple
+                lengths = [len(d['photon_energy_raw']) for d in data_list]
+                shape = (max(lengths, default=0), len(lengths))
+                photon_energy_raw = np.full(shape, np.nan)
+                eqe_raw = np.full_like(photon_energy_raw, np.nan)
+                for idx, d in enumerate(data_list):
+                    photon_energy_raw[: lengths[idx], idx] = d['photon_energy_raw']
+                    eqe_raw[: lengths[idx], idx] = d['intensty_raw']
+                photon_energies, eqes = interpolate_eqe_batch(
+                    photon_energy_raw, eqe_raw, lengths, grid_points, adaptive_grid
+                )
+
+            eqe_data = []
+            for idx, (d, band_gap) in enumerate(zip(data_list, band_gaps)):
+                values = {
+                    key: float(value[idx]) if np.isfinite(value[idx]) else None
+                    for key, value in radiative.items()
+                }
+                if values['voc_rad'] is None:
+                    logger.info(
+                        'Could not calculate the radiative Voc of the EQE spectrum, '
+                        'the Urbach energy is not below ~kB*T.',
+                        spectrum=d['name'],
+                    )
+                photon_energy, eqe = photon_energies[idx], eqes[idx]
+                eqe_data.append(
+                    SolarCellEQECustom(
+                        photon_energy_array=photon_energy,
+                        raw_photon_energy_array=d['photon_energy_raw'],
+                        wavelength_array=hc_eVnm / photon_energy,
+                        raw_wavelength_array=hc_eVnm / d['photon_energy_raw'],
+                        eqe_array=eqe,
+                        raw_eqe_array=d['intensty_raw'],
+                        bandgap_eqe=band_gap if np.isfinite(band_gap) else None,
+                        urbach_energy=values['urbach_e'],
+                        urbach_energy_fit_std_dev=values['urbach_e_std'],
+                        integrated_jsc=_with_unit(values['jsc'], ureg('A/m**2')),
+                        integrated_j0rad=_with_unit(values['j0rad'], ureg('A/m**2')),
+                        voc_rad=values['voc_rad'],
+                    )
+                )
+            self.eqe_data = eqe_data
+
+            band_gaps = band_gaps[np.isfinite(band_gaps)]
+            if len(band_gaps):
+                add_solar_cell(archive)
+                add_band_gap(archive, band_gaps.mean())
 
         super().normalize(archive, logger)
 
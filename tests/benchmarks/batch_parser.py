@@ -0,0 +1,186 @@
+"""
+Benchmark of `NRELExperimentParser` on synthetic experiment plans.
+
+Detecting the workbook (`is_mainfile`), reading it, mapping the rows to
+sections and writing the generated archives are timed separately. The
+results are written as JSON together with the exponent of the growth of
+every phase with the number of samples, ~1 for linear and ~2 for quadratic
+scaling. Run it from the root of the repository:
+
+    python -m tests.benchmarks.batch_parser --samples 10 100 1000
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from nomad import utils
+from nomad.datamodel import EntryArchive, EntryMetadata
+
+from nomad_nrel.parsers import nrel_batch_parser, nrel_experiment_parser
+
+from ..helpers import DirectoryContext, make_workbook
+
+PHASES = ('is_mainfile', 'read', 'mapping', 'emission')
+XLSX_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# Number of bytes of the file NOMAD passes to `is_mainfile`.
+BUFFER_SIZE = 8192
+
+
+# Functions of the parser module whose time is recorded as a phase
+TIMED_FUNCTIONS = {'read': 'read_workbook', 'emission': 'write_archives'}
+
+
+@contextmanager
+def time_functions(timings):
+    """
+    Records the time the parser spends in each of `TIMED_FUNCTIONS` under the
+    name of its phase.
+    """
+    functions = {
+        phase: getattr(nrel_batch_parser, name)
+        for phase, name in TIMED_FUNCTIONS.items()
+    }
+
+    def timed(phase, function):
+        def timed_function(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timings[phase] = time.perf_counter() - start
+
+        return timed_function
+
+    for phase, function in functions.items():
+        setattr(nrel_batch_parser, TIMED_FUNCTIONS[phase], timed(phase, function))
+    try:
+        yield
+    finally:
+        for phase, function in functions.items():
+            setattr(nrel_batch_parser, TIMED_FUNCTIONS[phase], function)
+
+
+def time_parser(parser, path, logger):
+    """
+    Runs the parser once on the workbook `path` into a new upload directory.
+
+    Returns:
+        whether the workbook was detected, the number of created entries and
+        the time of every phase in `PHASES` in seconds
+    """
+    timings = {}
+    with open(path, 'rb') as f:
+        buffer = f.read(BUFFER_SIZE)
+    start = time.perf_counter()
+    is_mainfile = bool(parser.is_mainfile(path, XLSX_MIME, buffer, None))
+    timings['is_mainfile'] = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        archive = EntryArchive(
+            m_context=DirectoryContext(directory),
+            metadata=EntryMetadata(
+                upload_id='benchmark', mainfile=os.path.basename(path)
+            ),
+        )
+        with time_functions(timings):
+            start = time.perf_counter()
+            parser.parse(path, archive, logger)
+            total = time.perf_counter() - start
+    timings['mapping'] = total - timings['read'] - timings['emission']
+    return is_mainfile, len(archive.data.processed_archive), timings
+
+
+def get_scaling(results):
+    """
+    Returns the exponent of a power law fit of the median time of every phase
+    and of the total time to the number of samples, None with less than two
+    sample counts.
+    """
+    samples = np.array([result['samples'] for result in results])
+    scaling = {}
+    for phase in (*PHASES, 'total'):
+        times = np.array([result[phase]['median'] for result in results])
+        if len(np.unique(samples)) < 2 or np.any(times <= 0):
+            scaling[phase] = None
+            continue
+        scaling[phase] = float(np.polyfit(np.log(samples), np.log(times), 1)[0])
+    return scaling
+
+
+def run_benchmark(sample_counts, n_process_groups=5, variation=0.1, repeat=3):
+    """
+    Generates a workbook for every number of samples in `sample_counts`, see
+    `make_workbook`, and times the parser `repeat` times on each of them.
+
+    Returns:
+        dict with the `environment`, one entry in `results` per workbook with
+        its layout and the minimum and median time of every phase, and the
+        `scaling` exponents, see `get_scaling`
+    """
+    parser = nrel_experiment_parser.load()
+    logger = utils.get_logger(__name__)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for n_samples in sample_counts:
+            path = os.path.join(directory, f'benchmark_{n_samples}.xlsx')
+            result = make_workbook(path, n_samples, n_process_groups, variation)
+            runs = [time_parser(parser, path, logger) for _ in range(repeat)]
+            result.update(
+                process_groups=n_process_groups,
+                variation=variation,
+                file_size=os.path.getsize(path),
+                is_mainfile=all(is_mainfile for is_mainfile, _, _ in runs),
+                created_entries=runs[0][1],
+            )
+            timings = [run[2] for run in runs]
+            for timing in timings:
+                timing['total'] = sum(timing[phase] for phase in PHASES)
+            for phase in (*PHASES, 'total'):
+                times = [timing[phase] for timing in timings]
+                result[phase] = {
+                    'min': min(times),
+                    'median': float(np.median(times)),
+                }
+            results.append(result)
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+        },
+        'results': results,
+        'scaling': get_scaling(results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--samples', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--process-groups', type=int, default=5)
+    parser.add_argument('--variation', type=float, default=0.1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='JSON file, defaults to stdout')
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        args.samples, args.process_groups, args.variation, args.repeat
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+Helpers shared by the tests and the benchmarks: a context of an upload in a
+local directory and a generator of synthetic experiment plan workbooks for
+`NRELExperimentParser`.
+
+The workbooks have the layout of the experiment plan template: a first header
+row with the process groups (only in the first cell of a group, like merged
+cells), a second one with the columns and one row per sample.
+"""
+
+import os
+
+from nomad.datamodel.context import Context
+from openpyxl import Workbook
+
+
+class DirectoryContext(Context):
+    """
+    Context of an upload whose raw files are kept in a local directory.
+    """
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        self.updated_files = []
+
+    def raw_path(self):
+        return self.directory
+
+    def raw_path_exists(self, path):
+        return os.path.exists(os.path.join(self.directory, path))
+
+    def raw_file(self, path, *args, **kwargs):
+        return open(os.path.join(self.directory, path), *args, **kwargs)
+
+    def process_updated_raw_file(self, path, allow_modify=False):
+        self.updated_files.append(path)
+
+
+SAMPLE_COLUMNS = (
+    'Date',
+    'Project_Name',
+    'Nomad ID',
+    'Variation',
+    'Sample dimension',
+    'Sample area [cm^2]',
+    'Substrate material',
+    'Substrate conductive layer',
+)
+
+# Columns and base values of the process groups, the last column is the one
+# that is varied between samples.
+PROCESS_GROUPS = (
+    ('Cleaning', {'Notes': 'variant'}),
+    (
+        'Spin Coating',
+        {
+            'Material name': 'MAPI',
+            'Layer type': 'Absorber',
+            'Solvent 1 name': 'DMF',
+            'Solvent 1 volume [uL]': 100,
+            'Solute 1 type': 'PbI2',
+            'Solute 1 Concentration [mM]': 1.2,
+            'Rotation time [s]': 30,
+            'Annealing temperature [°C]': 100,
+            'Annealing time [min]': 10,
+            'Rotation speed [rpm]': 3000,
+        },
+    ),
+    (
+        'Slot Die Coating',
+        {
+            'Material name': 'Me4PACz',
+            'Layer type': 'Hole Transport Layer',
+            'Solvent 1 name': 'Ethanol',
+            'Solvent 1 volume [uL]': 50,
+            'Head gap [mm]': 0.2,
+            'Speed [mm/s]': 5,
+            'Flow rate [ul/min]': 20,
+        },
+    ),
+    (
+        'Evaporation',
+        {
+            'Material name': 'C60',
+            'Layer type': 'Electron Transport Layer',
+            'Organic': 'yes',
+            'Rate [angstrom/s]': 0.2,
+            'Thickness [nm]': 20,
+        },
+    ),
+    (
+        'Sputtering',
+        {
+            'Material name': 'ITO',
+            'Layer type': 'Electrode',
+            'Gas': 'Ar',
+            'Thickness [nm]': 100,
+            'Power [W]': 50,
+        },
+    ),
+)
+
+
+def get_process_group(index):
+    """
+    Returns the name, e.g. `Spin Coating 2`, and the columns of the process
+    group at `index`. The groups cycle through `PROCESS_GROUPS`.
+    """
+    process, columns = PROCESS_GROUPS[index % len(PROCESS_GROUPS)]
+    return f'{process} {index + 1}', columns
+
+
+def get_varied_samples(n_samples, variation):
+    # the first samples get their own parameters, the others share the base
+    return min(n_samples, round(variation * n_samples))
+
+
+def get_value(value, variant):
+    if variant is None:
+        return value
+    if isinstance(value, str):
+        return f'{value} {variant}'
+    return value + variant
+
+
+def make_workbook(path, n_samples, n_process_groups=5, variation=0.1):
+    """
+    Writes an experiment plan with `n_samples` (at least one) samples of one
+    batch and `n_process_groups` process groups to `path`. In every group a
+    fraction `variation` of the samples has distinct parameters, the others
+    share one process.
+
+    Returns:
+        dict with the number of `samples`, `substrates`, `processes` and
+        `entries` the parser is expected to create
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+
+    groups = [get_process_group(index) for index in range(n_process_groups)]
+    group_row = ['Experiment Info'] + [None] * (len(SAMPLE_COLUMNS) - 1)
+    column_row = list(SAMPLE_COLUMNS)
+    for name, columns in groups:
+        group_row += [name] + [None] * (len(columns) - 1)
+        column_row += list(columns)
+    sheet.append(group_row)
+    sheet.append(column_row)
+
+    n_varied = get_varied_samples(n_samples, variation)
+    for sample in range(n_samples):
+        variant = sample + 1 if sample < n_varied else None
+        row = [
+            '2024-09-15',
+            'benchmark',
+            f'HZB_BM_B1_{sample}',
+            'base' if variant is None else f'variation {variant}',
+            '1x1',
+            0.1,
+            'glass',
+            'ITO',
+        ]
+        for _, columns in groups:
+            values = list(columns.values())
+            row += values[:-1] + [get_value(values[-1], variant)]
+        sheet.append(row)
+    workbook.save(path)
+
+    processes = n_process_groups * (n_varied + (n_varied < n_samples))
+    return {
+        'samples': n_samples,
+        'substrates': 1,
+        'processes': processes,
+        # the batch, the samples, their substrate and the processes
+        'entries': 2 + n_samples + processes,
+    }
@@ -0,0 +1,15 @@
+import pytest
+
+from .benchmarks.batch_parser import PHASES, run_benchmark
+
+
+@pytest.mark.benchmark
+def test_batch_parser_benchmark():
+    report = run_benchmark([5, 10], n_process_groups=3, variation=0.5, repeat=1)
+
+    assert len(report['results']) == 2
+    for result in report['results']:
+        assert result['is_mainfile']
+        assert result['created_entries'] == result['entries']
+        assert all(result[phase]['min'] >= 0 for phase in PHASES)
+    assert set(report['scaling']) == {*PHASES, 'total'}
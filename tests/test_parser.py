@@ -1,7 +1,40 @@
 import os
 
+import numpy as np
 import pytest
+from nomad import utils
 from nomad.client import normalize_all, parse
+from nomad.datamodel import EntryArchive, EntryMetadata
+from openpyxl import Workbook
+
+from nomad_nrel.parsers import nrel_experiment_parser
+from nomad_nrel.parsers.nrel_batch_parser import (
+    PROCESS_MAPPERS,
+    get_process_mapper,
+    map_cleaning,
+    map_sdc,
+    register_process_mapper,
+)
+from nomad_nrel.parsers.utils import sniff_workbook_header
+from nomad_nrel.schema_packages.file_parser.eqe_parser import (
+    get_radiative_parameters,
+    interpolate_eqe,
+    read_file,
+)
+from nomad_nrel.schema_packages.file_parser.jv_analysis import (
+    downsample_lttb,
+    get_jv_parameters,
+    get_jv_parameters_batch,
+)
+from nomad_nrel.schema_packages.file_parser.jv_parser import (
+    get_jv_data_stability_nrel,
+    iter_jv_stability_curves_nrel,
+    read_jv_file_nrel,
+    read_jv_stability_buffer_nrel,
+)
+from nomad_nrel.schema_packages.file_parser.parse_cache import ParseCache
+
+from .helpers import DirectoryContext, make_workbook
 
 
 def set_monkey_patch(monkeypatch):
@@ -100,3 +133,289 @@ def test_hy_batch_parser(monkeypatch):
             )
     assert count_samples_batches == 5
     delete_json()
+
+
+def test_process_mapper_registry():
+    assert get_process_mapper('Cleaning') == (map_cleaning, False)
+    assert get_process_mapper('Slot Die Coating 2') == (map_sdc, True)
+    assert get_process_mapper('Unknown Step') is None
+
+    register_process_mapper('Unknown Step', map_cleaning, requires_material=False)
+    try:
+        assert get_process_mapper('Unknown Step') == (map_cleaning, False)
+    finally:
+        del PROCESS_MAPPERS['Unknown Step']
+
+
+def test_sniff_workbook_header(tmp_path):
+    workbook = Workbook()
+    workbook.create_sheet('Plan', 0)
+    sheet = workbook['Plan']
+    sheet.append(['Experiment Info', None, 'Cleaning 1'])
+    sheet.append(['Date', 'Nomad ID', 'Notes'])
+    sheet.append(['2024-09-15', 'HZB_BM_B1_0', 'Nomad ID'])
+    sheet.merge_cells('A1:B1')
+    workbook['Sheet'].append(['Experiment Info', 'Nomad ID'])
+    path = str(tmp_path / 'plan.xlsx')
+    workbook.save(path)
+
+    assert sniff_workbook_header(path, 'Experiment Info', 'Nomad ID')
+    assert sniff_workbook_header(path, 'Cleaning 1', 'Notes')
+    assert not sniff_workbook_header(path, 'Experiment Info', 'Notes')
+    assert not sniff_workbook_header(path, 'Cleaning 1', 'Nomad ID')
+
+
+def test_reparse_edited_workbook(tmp_path):
+    parser = nrel_experiment_parser.load()
+    workbook = str(tmp_path / 'plan.xlsx')
+    upload = tmp_path / 'upload'
+    upload.mkdir()
+
+    def parse_workbook():
+        context = DirectoryContext(str(upload))
+        archive = EntryArchive(
+            m_context=context,
+            metadata=EntryMetadata(upload_id='test', mainfile='plan.xlsx'),
+        )
+        parser.parse(workbook, archive, utils.get_logger(__name__))
+        return set(context.updated_files)
+
+    def read_children():
+        return {path.name: path.read_text() for path in upload.glob('*.archive.json')}
+
+    make_workbook(workbook, 4, n_process_groups=2, variation=0.0)
+    assert parse_workbook() == set(read_children())
+    assert not parse_workbook()
+
+    # children of a parse that did not keep fingerprints are not rewritten
+    os.remove(upload / 'plan.xlsx.fingerprints.json')
+    assert not parse_workbook()
+    assert (upload / 'plan.xlsx.fingerprints.json').exists()
+
+    # a child edited in the upload is kept, the other changed ones rewritten
+    edited = upload / 'HZB_BM_B1_0.archive.json'
+    edited.write_text(edited.read_text() + '\n')
+    before = read_children()
+    make_workbook(workbook, 4, n_process_groups=2, variation=0.5)
+    written = parse_workbook()
+    after = read_children()
+    assert 'HZB_BM_B1_1.archive.json' in written
+    assert 'HZB_BM_B1_0.archive.json' not in written
+    assert after['HZB_BM_B1_0.archive.json'] == before['HZB_BM_B1_0.archive.json']
+    assert written == {name for name in after if before.get(name) != after[name]}
+
+
+def test_read_jv_file_blank_cells():
+    header_lines = [f'// Key {idx}: {idx}' for idx in range(15)]
+    lines = [
+        '// HEADER START',
+        '// File: test',
+        *header_lines,
+        '// HEADER END',
+        'Time\tVoltage\tCurrent\tPower',
+        '0\t-0.1\t-20.0\t2.0',
+        '1\t\t-19.0\t0.0',
+        '2\t0.1',
+        '3\t0.2\t-17.0\t-3.4',
+    ]
+    header, voltage, current = read_jv_file_nrel('\n'.join(lines))
+
+    assert header[7] == '7'
+    assert np.array_equal(voltage, [-0.1, np.nan, 0.1, 0.2], equal_nan=True)
+    assert np.array_equal(current, [-20.0, -19.0, np.nan, -17.0], equal_nan=True)
+
+
+STABILITY_LOG = [
+    '// ************** HEADER START ***************',
+    '// PxSize: 0.1',
+    '// Device: D1',
+    '// ************** HEADER END ***************',
+    '',
+    '# ********* START TEST HEADER *******',
+    '# Timestamp: 1000',
+    '# Light: 1.0',
+    '# ********* END TEST HEADER *******',
+    '',
+    '-2.0e-3\t0.0\t0.1',
+    '-1.0e-3\t0.5\t0.2',
+    '1.0e-3\t1.0\t0.3',
+    '',
+    '# ********* START TEST HEADER *******',
+    '# Timestamp: 1060',
+    '# Light: 0.5',
+    '# ********* END TEST HEADER *******',
+    '',
+    '-1.5e-3\t0.0\t60.1',
+    '\t0.5\t60.2',
+]
+
+
+@pytest.mark.parametrize('newline', ['\n', '\r\n'])
+@pytest.mark.parametrize('trailing_blank_line', [True, False])
+@pytest.mark.parametrize('binary', [False, True])
+def test_read_jv_stability(newline, trailing_blank_line, binary):
+    lines = STABILITY_LOG + [''] if trailing_blank_line else STABILITY_LOG
+    text = newline.join(lines) + newline
+    data = get_jv_data_stability_nrel(text.encode() if binary else text)
+
+    assert data['PxSize'] == '0.1'
+    assert data['Device'] == 'D1'
+    assert len(data['curves']) == 2
+    first, second = data['curves']
+    assert first['Timestamp'] == '1000'
+    assert second['Light'] == '0.5'
+    assert np.array_equal(first['data']['current'], [-2e-3, -1e-3, 1e-3])
+    assert np.array_equal(first['data']['voltage'], [0.0, 0.5, 1.0])
+    assert np.array_equal(first['data']['time'], [0.1, 0.2, 0.3])
+    assert np.array_equal(second['data']['current'], [-1.5e-3, np.nan], equal_nan=True)
+    assert np.array_equal(second['data']['voltage'], [0.0, 0.5])
+
+
+def test_stability_parsers_agree():
+    text = '\r\n'.join(STABILITY_LOG)
+    from_buffer = read_jv_stability_buffer_nrel(text.encode())
+    from_lines = list(iter_jv_stability_curves_nrel(text.splitlines(), chunk_size=1))
+
+    assert len(from_lines) == len(from_buffer['curves'])
+    for curve, expected in zip(from_lines, from_buffer['curves']):
+        assert curve.keys() == expected.keys()
+        for column, values in expected['data'].items():
+            assert np.array_equal(curve['data'][column], values, equal_nan=True)
+
+
+@pytest.mark.parametrize('binary', [False, True])
+def test_read_jv_stability_lines_without_value(binary):
+    lines = [*STABILITY_LOG]
+    lines.insert(lines.index('// Device: D1'), '// Notes')
+    lines.insert(lines.index('# Light: 1.0'), '#')
+    text = '\n'.join(lines) + '\n'
+    data = get_jv_data_stability_nrel(text.encode() if binary else text)
+
+    assert 'Notes' not in data
+    assert data['Device'] == 'D1'
+    assert len(data['curves']) == 2
+    assert data['curves'][0].keys() == {'Timestamp', 'Light', 'data'}
+
+
+def test_jv_parameters_batch():
+    # j = 20 * v - 20 gives Voc = 1 V, Jsc = 20 mA/cm**2 and the maximum
+    # power point at 0.5 V
+    voltage = np.linspace(-0.2, 1.2, 141)
+    parameters = get_jv_parameters_batch(
+        [voltage, voltage[:50], voltage[::-1]],
+        [20 * voltage - 20, 20 * voltage[:50] - 20, 20 * voltage[::-1] - 20],
+    )
+
+    expected = [1.0, 20.0, 0.25, 5.0]
+    for name, value in zip(parameters, expected):
+        assert parameters[name][[0, 2]] == pytest.approx([value, value])
+        # the truncated curve does not reach Voc
+        assert np.isnan(parameters[name][1])
+    assert get_jv_parameters(voltage, 20 * voltage - 20) == pytest.approx(expected)
+    assert get_jv_parameters(voltage[:50], 20 * voltage[:50] - 20) == (None,) * 4
+
+    # empty cells of the JV file are left out
+    current_density = 20 * voltage - 20
+    current_density[[40, 120]] = np.nan
+    voltage_with_blank = voltage.copy()
+    voltage_with_blank[100] = np.nan
+    assert get_jv_parameters(voltage_with_blank, current_density) == pytest.approx(
+        expected
+    )
+
+
+def test_downsample_lttb():
+    x = np.arange(1000, dtype=np.float64)
+    y = np.sin(x / 100)
+    y[500] = 10
+
+    indices = downsample_lttb(x, y, 50)
+    assert len(indices) == 50
+    assert indices[0] == 0
+    assert indices[-1] == 999
+    assert np.all(np.diff(indices) > 0)
+    assert 500 in indices
+    assert np.array_equal(downsample_lttb(x[:20], y[:20], 50), np.arange(20))
+
+
+def test_parse_cache(tmp_path):
+    calls = []
+
+    def parser(text, name):
+        calls.append(name)
+        return {'name': name, 'curves': [{'x': np.array([1.0, 2.0])}]}
+
+    cache = ParseCache(str(tmp_path), max_size=1024**2)
+    first = cache.parse(b'1\t2\n', parser, 1, 'a')
+    second = cache.parse(b'1\t2\n', parser, 1, 'a')
+    assert calls == ['a']
+    assert second['name'] == first['name']
+    assert np.array_equal(second['curves'][0]['x'], first['curves'][0]['x'])
+
+    cache.parse(b'1\t2\n', parser, 2, 'a')
+    assert calls == ['a', 'a']
+
+    cache.max_size = 0
+    cache.evict()
+    assert not list(tmp_path.glob('*.npz'))
+
+
+def test_parse_cache_size(tmp_path):
+    def parser(text, n_points):
+        return {'x': np.zeros(n_points)}
+
+    cache = ParseCache(str(tmp_path), max_size=20000)
+    cache.parse(b'large', parser, 1, 3000)
+    assert not list(tmp_path.glob('*.npz'))
+
+    for idx in range(20):
+        cache.parse(str(idx).encode(), parser, 1, 200)
+    sizes = [path.stat().st_size for path in tmp_path.glob('*.npz')]
+    assert 0 < sum(sizes) <= cache.max_size
+    assert cache.size == sum(sizes)
+
+
+def test_radiative_parameters():
+    photon_energy = np.linspace(1.2, 3.0, 1000)
+    eqes = [
+        0.8 / (1 + np.exp((1.6 - photon_energy) / urbach_e))
+        for urbach_e in (0.015, 0.1)
+    ]
+    result = get_radiative_parameters([photon_energy] * 2, eqes)
+
+    assert result['urbach_e'] == pytest.approx([0.015, 0.1], rel=0.1)
+    assert np.all(result['jsc'] > 0)
+    # no radiative limit for Urbach energies above ~kB*T
+    assert 1.2 < result['voc_rad'][0] < 1.6
+    assert np.isnan(result['voc_rad'][1])
+    assert np.isnan(result['j0rad'][1])
+
+
+def test_read_eqe_file(tmp_path):
+    file_path = tmp_path / 'eqe.csv'
+    rows = [
+        f'{wavelength},{80 - wavelength / 20}' for wavelength in range(300, 900, 10)
+    ]
+    file_path.write_text('\n'.join(['Sample 1', '', 'Wavelength (nm),EQE (%)', *rows]))
+
+    photon_energy_raw, eqe_raw, photon_energy, _ = read_file(file_path, 2)
+    assert len(photon_energy_raw) == len(rows)
+    assert np.all(np.diff(photon_energy_raw) > 0)
+    assert eqe_raw.max() < 1
+    assert len(photon_energy) == 1000
+
+
+def test_interpolation_grids():
+    photon_energy_raw = np.linspace(1.2, 3.0, 500)
+    eqe_raw = 0.8 / (1 + np.exp((1.6 - photon_energy_raw) / 0.02))
+
+    grid, _ = interpolate_eqe(photon_energy_raw, eqe_raw, 200)
+    assert interpolate_eqe(photon_energy_raw, eqe_raw, 200)[0] is grid
+    assert not grid.flags.writeable
+
+    grid, _ = interpolate_eqe(photon_energy_raw, eqe_raw, 200, True)
+    assert grid[0] == pytest.approx(1.2)
+    assert grid[-1] == pytest.approx(3.0)
+    # denser at the absorption edge than far above it
+    steps = np.diff(grid)
+    assert steps[np.searchsorted(grid, 1.6)] < steps[-1] / 4